@@ -1,506 +1,414 @@
 import os
 import json
-import random
-from flask import Flask, request, abort, render_template, jsonify
-from linebot import LineBotApi, WebhookHandler
+import threading
+import time
+from collections import OrderedDict
+from flask import Flask, Response, request, abort, render_template, jsonify
+from linebot import WebhookParser
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
+from linebot.models import MessageEvent, TextMessage
+
+from game import CARD_INDEX
+from commands import Command, parse_command, format_command, apply_command, is_rejection
+from messages import render_events
+from store import create_store
+from dispatcher import Dispatcher
+from line_client import LineClient
+from ratelimit import RateLimiter
+import bots
+import compression
+import metrics
+import views
 
 app = Flask(__name__)
 
-line_bot_api = LineBotApi(os.environ.get('CHANNEL_ACCESS_TOKEN'))
-handler = WebhookHandler(os.environ.get('CHANNEL_SECRET'))
+# 送出訊息 (連線池/重試/斷路器，LINE_API_URL 可指向本地替身)
+line = LineClient(os.environ.get('CHANNEL_ACCESS_TOKEN'))
+parser = WebhookParser(os.environ.get('CHANNEL_SECRET'))
 LIFF_ID = "2008575273-k4yRga2r"
-
-# --- 遊戲常數 ---
-HAND_LIMIT = 6       
-GEM_LIMIT = 5        
-WIN_GRAIL_COUNT = 5  
-
-# --- 全域變數 ---
-players_db = {}
-game_deck = []
-discard_pile = []
-
-game_state = {
-    'turn_order': [],     
-    'current_turn_idx': 0, 
-    'phase': 'WAITING',   
-    'attack_chain': None, 
-    'missile_chain': None,
-    'active_player_id': None, 
-    'pending_draw_count': 0,
-    'next_phase_after_clean': 'NEXT_TURN',
-    'teams': {
-        'RED': {'morale': 15, 'gems': [], 'grails': 0}, 
-        'BLUE': {'morale': 15, 'gems': [], 'grails': 0}
-    }
-}
-
-# --- 1. 卡牌資料庫 (移到最上方確保全域可見) ---
-CARD_DB_LIST = [
-    {"id": "atk_fire", "name": "火攻擊", "type": "attack", "element": "fire", "damage": 2, "count": 10},
-    {"id": "atk_water", "name": "水攻擊", "type": "attack", "element": "water", "damage": 2, "count": 10},
-    {"id": "atk_wind", "name": "風攻擊", "type": "attack", "element": "wind", "damage": 2, "count": 10},
-    {"id": "atk_earth", "name": "地攻擊", "type": "attack", "element": "earth", "damage": 2, "count": 10},
-    {"id": "atk_thunder", "name": "雷攻擊", "type": "attack", "element": "thunder", "damage": 2, "count": 10},
-    {"id": "atk_dark", "name": "暗黑攻擊", "type": "attack", "element": "dark", "damage": 2, "count": 5},
-    {"id": "def_light", "name": "聖光", "type": "magic", "element": "light", "damage": 0, "count": 5},
-    {"id": "sup_shield", "name": "聖盾", "type": "magic", "element": "light", "damage": 0, "count": 5},
-    {"id": "mgc_missile", "name": "魔彈", "type": "magic", "element": "none", "damage": 2, "count": 5},
-    {"id": "mgc_poison", "name": "中毒", "type": "magic", "element": "none", "damage": 0, "count": 3},
-    {"id": "mgc_weak", "name": "虛弱", "type": "magic", "element": "none", "damage": 0, "count": 3}
-]
-CARD_MAP = { c['name']: c for c in CARD_DB_LIST }
+# LIFF 頁面的快取秒數 (過期後以 ETag 重新驗證，內容沒變只回 304)
+LIFF_CACHE_SECONDS = int(os.environ.get('LIFF_CACHE_SECONDS', 3600))
+
+# 遊戲狀態儲存 (GAME_STORE=memory/sqlite/redis，多 worker 請用 sqlite 或 redis)
+store = create_store()
+# Webhook 事件佇列 (同一桌依序、不同桌平行)
+dispatcher = Dispatcher()
+# reply token 有時效：事件發生超過此時間 (毫秒) 才輪到送出就改用 push 訊息
+REPLY_DEADLINE_MS = int(os.environ.get('REPLY_DEADLINE_MS', 50000))
+# 設定 PROFILE_INTERVAL_MS 才啟用取樣分析 (保留最慢的 PROFILE_KEEP 則訊息與其堆疊)
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 0))
+profiler = metrics.SlowCommandProfiler(PROFILE_INTERVAL_MS / 1000, int(os.environ.get('PROFILE_KEEP', 20))) if PROFILE_INTERVAL_MS else None
+# 限流 (每秒權杖數, 最多累積數；設 0 關閉)：聊天指令依 LINE 使用者與桌，/api/* 依 (端點, 桌, 玩家) 與 (端點, 桌)
+user_limiter = RateLimiter(float(os.environ.get('RATE_USER_PER_SEC', 2)), float(os.environ.get('RATE_USER_BURST', 6)))
+game_limiter = RateLimiter(float(os.environ.get('RATE_GAME_PER_SEC', 5)), float(os.environ.get('RATE_GAME_BURST', 15)))
+api_client_limiter = RateLimiter(float(os.environ.get('RATE_API_PER_SEC', 10)), float(os.environ.get('RATE_API_BURST', 20)))
+api_game_limiter = RateLimiter(float(os.environ.get('RATE_API_GAME_PER_SEC', 40)), float(os.environ.get('RATE_API_GAME_BURST', 80)))
+# 每桌最多排隊幾則指令 (超過就丟棄，避免一桌洗版拖慢同一條執行緒上的其他桌)
+GAME_QUEUE_LIMIT = int(os.environ.get('GAME_QUEUE_LIMIT', 16))
+# LINE 重送的事件 (同一個 webhookEventId) 只處理一次：記住最近 RECENT_EVENTS 個事件 ID (每個 worker 各自記)
+RECENT_EVENTS = int(os.environ.get('RECENT_EVENTS', 4096))
+recent_events = OrderedDict()
+recent_events_lock = threading.Lock()
+# 電腦玩家的思考池 (行程池，BOT_WORKERS 個子行程，每步最多想 BOT_MOVE_MS 毫秒，超過 BOT_TIMEOUT_MS 改用快速走法)
+bot_pool = bots.BotPool()
+# 每桌電腦出手的速度上限 (每秒步數；設 0 不限)：全是電腦的桌不會在幾秒內下完並對聊天室連發推播，想得快的步會延後而不是丟棄
+bot_move_limiter = RateLimiter(float(os.environ.get('BOT_MOVES_PER_SEC', 1)), 1)
+# SSE 連線最長存活秒數 (到期由瀏覽器自動重連，避免長期佔住 worker) 與心跳間隔
+STREAM_LIFETIME = 25
+STREAM_PING = 10
+# 每個 worker 同時開著的 SSE 上限 (每條佔一個執行緒)；額滿時回 204，瀏覽器改用 ETag 輪詢
+STREAM_MAX_OPEN = int(os.environ.get('STREAM_MAX_OPEN', int(os.environ.get('GUNICORN_THREADS', 16)) // 4))
+open_streams = {'count': 0}
+open_streams_lock = threading.Lock()
+
+# --- 指標 ---
+COMMAND_SECONDS = metrics.Histogram('stargrail_command_seconds', '規則引擎套用一個指令的耗時', ['phase', 'command'])
+MESSAGE_SECONDS = metrics.Histogram('stargrail_message_seconds', 'handle_message 處理一則訊息的總耗時 (含儲存與回覆)', ['phase', 'command'])
+RESHUFFLES = metrics.Counter('stargrail_deck_reshuffles_total', '棄牌堆洗回牌堆的次數')
+BOT_MOVES = metrics.Counter('stargrail_bot_moves_total', '電腦玩家出手次數 (search=搜尋，quick=思考池忙碌或故障時的快速走法，timeout=逾時改用快速走法，stale=想好時牌局已變動而放棄)', ['source'])
+DROPPED = metrics.Counter('stargrail_dropped_total', '未處理就丟棄的訊息/請求 (not_command/rate_user/rate_game/full/duplicate/rate_api/stream_full)', ['reason'])
+metrics.Gauge('stargrail_queue_depth', '排隊中的工作數', lambda: {('webhook',): dispatcher.depth(), ('push',): line.sender.depth()}, ['queue'])
+metrics.Gauge('stargrail_live_games', '進行中的牌局數', lambda: (store.stats() or (None,))[0])
+metrics.Gauge('stargrail_live_players', '進行中牌局的玩家數', lambda: (store.stats() or (None, None))[1])
+metrics.Gauge('stargrail_open_streams', '目前開著的 SSE 連線數 (本 worker)', lambda: open_streams['count'])
+metrics.Gauge('stargrail_line_circuit_open', 'LINE 斷路器是否開啟 (1=開路或試探中)', lambda: int(line.breaker.state() != 'closed'))
+
+# --- 預熱 ---
+# gunicorn.conf.py：master 載入後 (fork 前) 呼叫 prepare()，每個 worker fork 後呼叫 warm_worker()
+warm_state = {'prepared': False, 'worker_pid': None, 'warming': None, 'line_reachable': None}
+# 預先產生並壓縮好的 LIFF 頁面 (內容只取決於常數 LIFF_ID)
+liff_page = None
+
+def prepare():
+    """與行程無關的準備 (preload 時在 master 做一次，worker 以 copy-on-write 共用)"""
+    global liff_page
+    with app.app_context(): liff_page = compression.Precompressed(render_template('game.html', liff_id=LIFF_ID), 'text/html')
+    warm_state['prepared'] = True
+
+def warm_worker():
+    """每個 worker 行程：啟動佇列執行緒、在背景預先連上 LINE API (電腦玩家的思考池等到有人 @電腦 才建立)"""
+    if not warm_state['prepared']: prepare()
+    # 記憶體儲存在這裡 (worker 行程內) 從日誌/休眠檔還原；其他儲存順便確認連得上
+    store.version('__warm__')
+    dispatcher.start()
+    # LINE 連不上時要等連線逾時加重試 (十幾秒)：不擋住 worker 啟動，結果由 /readyz 的 line_reachable 回報
+    warm_state['line_reachable'] = None
+    threading.Thread(target=warm_line, daemon=True).start()
+    warm_state['worker_pid'] = os.getpid()
+
+def warm_line():
+    warm_state['line_reachable'] = line.warm()
+
+def is_warm():
+    return warm_state['prepared'] and warm_state['worker_pid'] == os.getpid()
 
 # --- 輔助函數 ---
 
-def init_deck():
-    """初始化牌堆"""
-    global game_deck, discard_pile
-    game_deck = []
-    for card_data in CARD_DB_LIST:
-        qty = card_data.get('count', 1)
-        for _ in range(qty):
-            game_deck.append(card_data['name'])
-    random.shuffle(game_deck)
-    discard_pile = []
-    print(f"Deck Initialized: {len(game_deck)} cards.")
-
-def draw_cards_from_deck(count):
-    """抽牌 (含自動洗牌與強制補牌機制)"""
-    global game_deck, discard_pile
-    drawn = []
-    
-    # 保險機制：如果牌堆和棄牌堆都空了，重新生成一副新牌
-    if not game_deck and not discard_pile:
-        print("Deck empty! Re-initializing...")
-        init_deck()
-
-    for _ in range(count):
-        if not game_deck:
-            if discard_pile:
-                game_deck = discard_pile[:]
-                random.shuffle(game_deck)
-                discard_pile = []
-            else:
-                # 真的沒牌了 (極端情況)
-                break 
-        
-        if game_deck:
-            drawn.append(game_deck.pop())
-            
-    return drawn
-
-def get_current_player_id():
-    if not game_state['turn_order']: return None
-    return game_state['turn_order'][game_state['current_turn_idx']]
-
-def add_gem(team_name, color):
-    """增加寶石 (不超過上限)"""
-    team = game_state['teams'][team_name]
-    if len(team['gems']) < GEM_LIMIT:
-        team['gems'].append(color)
-        return True
-    return False
+def get_source_id(source):
+    """以 群組 > 聊天室 > 使用者 的 ID 作為房間鍵"""
+    return getattr(source, 'group_id', None) or getattr(source, 'room_id', None) or source.user_id
 
-def check_counter_validity(attack_elem, respond_card_name):
-    resp_data = CARD_MAP.get(respond_card_name)
-    if not resp_data: return False, "卡牌錯誤"
-    resp_elem = resp_data['element']
-    
-    if resp_data['name'] == '聖光': return True, "聖光"
-    if attack_elem == 'dark': return False, "暗屬性攻擊無法應戰"
-    if attack_elem == resp_elem: return True, "同屬性應戰"
-    if resp_elem == 'dark': return True, "暗屬性應戰"
-    return False, f"屬性不符 ({attack_elem} vs {resp_elem})"
-
-# --- 流程控制 ---
-
-def prepare_draw_phase(player_id, count, msg_prefix=""):
-    """進入摸牌階段"""
-    if count <= 0: return check_discard_phase(player_id, msg_prefix)
-    
-    game_state['phase'] = 'DRAWING'
-    game_state['active_player_id'] = player_id
-    game_state['pending_draw_count'] = count
-    p = players_db[player_id]
-    return f"{msg_prefix}\n🎴 請 {p['name']} 摸牌 (需摸 {count} 張)"
-
-def check_discard_phase(player_id, msg_prefix=""):
-    """檢查棄牌"""
-    p = players_db[player_id]
-    excess = len(p['hand']) - HAND_LIMIT
-    if excess > 0:
-        game_state['phase'] = 'DISCARDING'
-        game_state['active_player_id'] = player_id
-        game_state['pending_draw_count'] = excess
-        return f"{msg_prefix}\n⚠️ 手牌過多 ({len(p['hand'])}/{HAND_LIMIT})！請棄 {excess} 張。"
-    else:
-        return proceed_after_clean(msg_prefix)
-
-def proceed_after_clean(msg_prefix=""):
-    """手牌整理後的流向"""
-    next_step = game_state['next_phase_after_clean']
-    
-    if next_step == 'ACTION':
-        # 回到該玩家的回合
-        game_state['phase'] = 'ACTION'
-        game_state['active_player_id'] = None
-        game_state['next_phase_after_clean'] = 'NEXT_TURN' # 重置
-        pid = get_current_player_id()
-        p = players_db[pid]
-        return f"{msg_prefix}\n👉 輪到 {p['name']} 主動行動！"
-    else:
-        return next_turn(msg_prefix)
-
-def resolve_damage_init(target_id, damage_amount, source_type="attack", next_phase='NEXT_TURN'):
-    """結算傷害 -> 產石 -> 進入摸牌"""
-    game_state['next_phase_after_clean'] = next_phase
-    player = players_db.get(target_id)
-    heal = player.get('heal_points', 0)
-    actual_heal = min(damage_amount, heal)
-    final_damage = damage_amount - actual_heal
-    if actual_heal > 0: player['heal_points'] -= actual_heal
-    
-    msg = f"🛡️ 結算：傷{damage_amount} (癒{actual_heal}) = {final_damage}。"
-    
-    if final_damage > 0:
-        attacker_team = "RED" if player['team'] == "BLUE" else "BLUE"
-        gem_color = "red" if source_type == "attack" else "blue"
-        if add_gem(attacker_team, gem_color): 
-            msg += f" ({attacker_team}獲得{'紅' if gem_color=='red' else '藍'}石)"
-            
-    return prepare_draw_phase(target_id, final_damage, msg)
-
-def next_turn(prev_msg=""):
-    """回合切換"""
-    total = len(game_state['turn_order'])
-    game_state['current_turn_idx'] = (game_state['current_turn_idx'] + 1) % total
-    game_state['attack_chain'] = None
-    game_state['missile_chain'] = None
-    game_state['phase'] = 'ACTION'
-    game_state['active_player_id'] = None
-    game_state['next_phase_after_clean'] = 'NEXT_TURN'
-    
-    pid = get_current_player_id()
-    p = players_db[pid]
-    
-    extra_msg = ""
-    # 虛弱
-    if p['buffs']['weak']:
-        game_state['phase'] = 'CHOOSING_WEAKNESS'
-        game_state['active_player_id'] = pid
-        return f"{prev_msg}\n{extra_msg}\n👉 輪到 {p['name']} (虛弱狀態)\n請選擇 @摸牌 或 @跳過"
-
-    # 中毒
-    if p['buffs']['poison']:
-        return f"{prev_msg}\n☠️ {p['name']} 中毒發作！\n" + resolve_damage_init(pid, 1, source_type="magic", next_phase='ACTION')
-
-    return f"{prev_msg}\n👉 輪到 [{p['team']}] {p['name']} 的回合！"
+def liff_url(room_id):
+    return f"https://liff.line.me/{LIFF_ID}?room={room_id}"
+
+def send_reply(event, text):
+    """交給 LINE 送出佇列 (不佔用該桌的執行緒)：優先用 reply token 回覆，過了期限或 token 失效則改用 push"""
+    line.reply(event.reply_token, get_source_id(event.source), [text], deadline=(event.timestamp + REPLY_DEADLINE_MS) / 1000)
 
 # --- API ---
 @app.route("/liff")
-def liff_entry(): return render_template('game.html', liff_id=LIFF_ID)
+def liff_entry():
+    if liff_page is None: prepare()
+    encoding, data, etag = liff_page.select(request.accept_encodings)
+    if request.if_none_match.contains(etag): resp = Response(status=304)
+    else: resp = Response(data, mimetype=liff_page.mimetype)
+    if encoding: resp.headers['Content-Encoding'] = encoding
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f"public, max-age={LIFF_CACHE_SECONDS}"
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+def player_list(room):
+    """在該桌的鎖內組好玩家列表 (開局會清空再重建 players)"""
+    lst = []
+    for pid in room.state['turn_order']:
+        p = room.players[pid]
+        lst.append({'id': pid, 'name': p.name, 'team': p.team, 'hand_count': p.hand_size, 'buffs': dict(p.buffs)})
+    return lst
 
 @app.route("/api/get_all_players", methods=['GET'])
 def get_all_players():
-    if not game_state['turn_order']: return jsonify([])
-    lst = []
-    for pid in game_state['turn_order']:
-        p = players_db[pid]
-        lst.append({'id': pid, 'name': p['name'], 'team': p['team'], 'hand_count': len(p['hand']), 'buffs': p['buffs']})
-    return jsonify(lst)
+    room_id = request.args.get('room')
+    return jsonify((room_id and store.read(room_id, player_list)) or [])
 
-@app.route("/api/my_status", methods=['POST'])
+def status_entry(room_id):
+    """該桌目前版本的共用視圖 (已快取時只查版本號，不必載入整桌狀態)"""
+    return views.cached(room_id, store.version(room_id)) or store.read(room_id, views.view_entry)
+
+@app.route("/api/my_status", methods=['GET', 'POST'])
 def get_my_status():
-    data = request.json
+    data = request.json if request.method == 'POST' else request.args
+    room_id = data.get('room')
     target_id = data.get('simulate_id')
-    if not target_id or target_id not in players_db: return jsonify({'error': '請先 @測試開局'})
-    
-    active_id = game_state.get('active_player_id')
-    curr_turn_id = get_current_player_id()
-    
-    turn_owner_id = None
-    if game_state['phase'] == 'ACTION': turn_owner_id = curr_turn_id
-    elif game_state['phase'] in ['DRAWING', 'DISCARDING', 'CHOOSING_WEAKNESS']: turn_owner_id = active_id
-    elif game_state['phase'] == 'RESOLVING': 
-        if game_state['attack_chain']: turn_owner_id = game_state['attack_chain']['target_id']
-    elif game_state['phase'] == 'RESOLVING_MISSILE':
-        if game_state['missile_chain']: turn_owner_id = game_state['missile_chain']['target_id']
-
-    p = players_db[target_id]
-    response = p.copy()
-    response['my_id'] = target_id
-    response['game_phase'] = game_state['phase']
-    response['turn_owner_id'] = turn_owner_id
-    response['is_my_turn'] = (target_id == turn_owner_id)
-    response['teams'] = game_state['teams']
-    response['pending_count'] = game_state.get('pending_draw_count', 0)
-    
-    if game_state['attack_chain']:
-        response['incoming_attack'] = {
-            'type': 'normal', 'source_name': game_state['attack_chain']['source_name'],
-            'target_id': game_state['attack_chain']['target_id'],
-            'card_name': game_state['attack_chain']['card_name'],
-            'element': game_state['attack_chain']['element']
-        }
-    elif game_state['missile_chain']:
-        response['incoming_attack'] = {
-            'type': 'missile', 'source_name': "魔彈連鎖",
-            'target_id': game_state['missile_chain']['target_id'],
-            'damage': game_state['missile_chain']['damage']
-        }
-    else:
-        response['incoming_attack'] = None
-
-    all_list = []
-    for pid in game_state['turn_order']:
-        pp = players_db[pid]
-        all_list.append({'name': pp['name'], 'team': pp['team'], 'id': pid})
-    response['all_players'] = all_list
-
-    return jsonify(response)
+
+    # 條件式 GET：版本沒變只查版本號就回 304，不必載入整桌狀態
+    if request.method == 'GET' and room_id and request.if_none_match:
+        version = str(store.version(room_id))
+        if request.if_none_match.contains_weak(version):
+            resp = Response(status=304)
+            resp.set_etag(version)
+            return resp
+
+    entry = status_entry(room_id) if room_id else None
+    if not entry or target_id not in entry['private']: return jsonify({'error': '請先 @測試開局'})
+
+    # 差異模式：帶 since=<上次版本> 時只回傳變動的欄位
+    since = data.get('since', type=int) if request.method == 'GET' else data.get('since')
+    body = views.delta_json(entry, target_id, since) if since is not None and since != entry['version'] else None
+    resp = Response(body or views.status_json(entry, target_id), mimetype='application/json')
+    resp.set_etag(str(entry['version']))
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.route("/api/stream", methods=['GET'])
+def stream_status():
+    """SSE：該桌版本變化時才推送 (瀏覽器收到後再以條件式 GET 取狀態)"""
+    room_id = request.args.get('room')
+    if not room_id: abort(400)
+    with open_streams_lock:
+        full = open_streams['count'] >= STREAM_MAX_OPEN
+        if not full: open_streams['count'] += 1
+    if full:
+        DROPPED.inc('stream_full')
+        return Response(status=204)
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None: since = store.version(room_id)
+
+    def events(version):
+        deadline = time.monotonic() + STREAM_LIFETIME
+        yield "retry: 1000\n\n"
+        while time.monotonic() < deadline:
+            current = store.wait(room_id, version, min(STREAM_PING, max(0, deadline - time.monotonic())))
+            if current != version:
+                version = current
+                yield f"id: {version}\nevent: version\ndata: {version}\n\n"
+            else:
+                yield ": ping\n\n"
+
+    def closed():
+        with open_streams_lock: open_streams['count'] -= 1
+
+    resp = Response(events(since), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    resp.call_on_close(closed)
+    return resp
+
+# LIFF 按鈕的結構化操作 -> 指令動詞
+ACTION_VERBS = {'buy': 'BUY', 'synth': 'SYNTH', 'extract': 'EXTRACT', 'draw': 'DRAW', 'skip': 'SKIP', 'take': 'TAKE', 'discard': 'DISCARD', 'play': 'PLAY', 'counter': 'COUNTER'}
+
+def action_to_command(room, actor_id, data):
+    """把 /api/action 的 JSON 轉成 Command (玩家以 ID 指定)"""
+    verb = ACTION_VERBS.get(data.get('action'))
+    if not verb: return None
+    card = CARD_INDEX.get(data.get('card'))
+    if verb in ('DISCARD', 'PLAY', 'COUNTER') and card is None: return None
+    target = room.players.get(data.get('target'))
+    return Command(verb, room.players[actor_id].name, card, target.name if target else None)
+
+def announce(room_id, text, reply):
+    """把 LIFF 上的操作與結果公告到聊天室"""
+    line.push(room_id, [text, reply])
+
+def update_room(room_id, fn):
+    """store.update，並在同一把鎖內檢查接下來是否輪到電腦 (是的話送去思考，不等結果)"""
+    pending = []
+    outcome = {}
+    def run(room):
+        result = fn(room)
+        # 被拒絕的指令 (例如手牌已滿還購買) 沒有改變狀態：只回覆，不寫入 (版本不變、不喚醒 SSE、不記日誌)
+        outcome['rejected'] = result if result is not None and is_rejection(room.events) else None
+        if outcome['rejected'] is not None: return None
+        # store 在 fn 回傳後才把版本 +1
+        if result is not None: pending.append(bots.snapshot(room, room.version + 1))
+        return result
+    result = store.update(room_id, run)
+    # Redis 衝突重試時 fn 會執行多次，以最後一次為準
+    if pending and pending[-1]: bot_pool.think(pending[-1], on_bot_move)
+    return outcome['rejected'] if result is None else result
+
+def on_bot_move(room_id, version, cmd, source):
+    """電腦想好了：排回該桌的佇列執行，與 webhook 事件維持同一順序；這桌出手太快時等到下一個空檔"""
+    wait = bot_move_limiter.take(room_id)
+    if wait:
+        timer = threading.Timer(wait, on_bot_move, (room_id, version, cmd, source))
+        timer.daemon = True
+        return timer.start()
+    dispatcher.submit(room_id, apply_bot_move, room_id, version, cmd, source)
+
+def apply_bot_move(room_id, version, cmd, source):
+    def apply(room):
+        # 思考期間牌局已變動 (例如重新開局)：放棄這一步，變動時已另外安排思考
+        if room.version != version or cmd is None: return None
+        events = timed_apply(room, cmd)
+        return render_events(room, events) if events else None
+    reply = update_room(room_id, apply)
+    BOT_MOVES.inc(source if reply else 'stale')
+    if reply: announce(room_id, f"🤖 {format_command(cmd)}", reply)
+
+@app.route("/api/action", methods=['POST'])
+def post_action():
+    """直接套用一個操作並回傳最新狀態 (不經 LINE 聊天室繞一圈)"""
+    data = request.get_json(silent=True) or {}
+    room_id = data.get('room')
+    actor_id = data.get('simulate_id')
+    if not room_id or not actor_id: return jsonify({'error': '缺少 room 或 simulate_id'}), 400
+
+    applied = {}
+    def apply(room):
+        applied['room'] = room
+        if actor_id not in room.players: return None
+        cmd = action_to_command(room, actor_id, data)
+        if not cmd: return None
+        applied['text'] = format_command(cmd)
+        applied['events'] = timed_apply(room, cmd)
+        return render_events(room, applied['events']) if applied['events'] else None
+
+    reply = update_room(room_id, apply)
+    room = applied.get('room') or store.get(room_id)
+    if not room or actor_id not in room.players: return jsonify({'error': '請先 @測試開局'}), 404
+    if not reply: return jsonify({'ok': False, 'error': '無法執行此操作', 'status': views.status(status_entry(room_id), actor_id)}), 409
+
+    # 公告送到佇列，與該桌的 webhook 事件維持同一順序
+    dispatcher.submit(room_id, announce, room_id, applied['text'], reply)
+    ok = not is_rejection(applied['events'])
+    return jsonify({'ok': ok, 'message': reply, 'events': applied['events'], 'status': views.status(status_entry(room_id), actor_id)})
+
+@app.before_request
+def limit_api():
+    """/api/* 限流：同一玩家 (沒帶玩家時以來源 IP) 與同一桌各有額度，超過回 429"""
+    if not request.path.startswith('/api/'): return None
+    args = request.args if request.method == 'GET' else (request.get_json(silent=True) or {})
+    room_id = str(args.get('room'))
+    client = args.get('simulate_id') or request.remote_addr
+    wait = api_client_limiter.take((request.path, room_id, client)) or api_game_limiter.take((request.path, room_id))
+    if not wait: return None
+    DROPPED.inc('rate_api')
+    resp = jsonify({'error': '操作太頻繁，請稍後再試'})
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(max(1, round(wait)))
+    return resp
+
+@app.after_request
+def compress_api(resp):
+    """/api/* 的 JSON 依 Accept-Encoding 壓縮 (SSE 串流與小回應不壓)"""
+    if not request.path.startswith('/api/') or resp.status_code != 200 or resp.is_streamed or resp.direct_passthrough: return resp
+    if resp.mimetype != 'application/json' or 'Content-Encoding' in resp.headers: return resp
+    resp.vary.add('Accept-Encoding')
+    encoding = compression.negotiate(request.accept_encodings)
+    data = resp.get_data()
+    if not encoding or len(data) < compression.MIN_BYTES: return resp
+    resp.set_data(compression.compress(data, encoding))
+    resp.headers['Content-Encoding'] = encoding
+    # 壓縮後的內容與原文不同，ETag 改為弱 ETag (版本號仍可用於條件式 GET)
+    etag, weak = resp.get_etag()
+    if etag and not weak: resp.set_etag(etag, weak=True)
+    return resp
+
+@app.route("/healthz")
+def healthz():
+    """存活檢查：行程能回應即可"""
+    return jsonify({'ok': True, 'pid': os.getpid()})
+
+@app.route("/readyz")
+def readyz():
+    """就緒檢查：預熱完成、儲存可用才回 200 (未預熱時在背景補做並先回 503)；
+    LINE 斷路器狀態與連線是否已建立 (line_reachable：None 為還在連) 只供參考 (LINE 故障是所有 worker 共同的問題，不該把它們全部移出負載平衡)"""
+    if not is_warm() and warm_state['warming'] != os.getpid():
+        warm_state['warming'] = os.getpid()
+        threading.Thread(target=warm_worker, daemon=True).start()
+    checks = {'warm': is_warm()}
+    try:
+        store.version('__readyz__')
+        checks['store'] = True
+    except Exception:
+        checks['store'] = False
+    ready = all(checks.values())
+    return jsonify({'ready': ready, 'checks': checks, 'line_circuit': line.breaker.state(), 'line_reachable': warm_state['line_reachable']}), 200 if ready else 503
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/debug/slow_commands")
+def slow_commands():
+    """取樣分析結果 (需設定 PROFILE_INTERVAL_MS)"""
+    if not profiler: abort(404)
+    return jsonify(profiler.dump())
 
 @app.route("/callback", methods=['POST'])
 def callback():
-    try: handler.handle(request.get_data(as_text=True), request.headers['X-Line-Signature'])
+    # 只驗簽並排入佇列，立即回 200，避免 LINE 因逾時重送
+    try: events = parser.parse(request.get_data(as_text=True), request.headers.get('X-Line-Signature', ''))
     except InvalidSignatureError: abort(400)
+    for event in events:
+        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage): enqueue_message(event)
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessage)
-def handle_message(event):
+def enqueue_message(event):
+    """過濾與限流 (都不碰牌局狀態)，通過的指令排入該桌的佇列"""
+    # 先用指令的正規表示式過濾閒聊，閒聊不必載入牌局
+    cmd = parse_command(event.message.text)
+    if cmd is None: return DROPPED.inc('not_command')
+    if is_redelivery(event): return DROPPED.inc('duplicate')
+    room_id = get_source_id(event.source)
+    if user_limiter.take(getattr(event.source, 'user_id', None) or room_id): return DROPPED.inc('rate_user')
+    if game_limiter.take(room_id): return DROPPED.inc('rate_game')
+    if not dispatcher.submit(room_id, handle_message, event, cmd, limit=GAME_QUEUE_LIMIT): DROPPED.inc('full')
+
+def is_redelivery(event):
+    """同一個事件 ID 已經收過 (LINE 逾時重送)；玩家真的再送一次同樣的指令 (例如連續摸牌) 是不同的事件"""
+    event_id = getattr(event, 'webhook_event_id', None) or getattr(event.message, 'id', None)
+    if event_id is None: return False
+    with recent_events_lock:
+        if event_id in recent_events: return True
+        recent_events[event_id] = True
+        if len(recent_events) > RECENT_EVENTS: recent_events.popitem(last=False)
+    return False
+
+def handle_message(event, cmd=None):
     msg = event.message.text.strip()
-    
-    # 開局
-    if msg == "@測試開局":
-        init_deck()
-        players_db.clear()
-        game_state['teams'] = {'RED': {'morale': 15, 'gems': [], 'grails': 0}, 'BLUE': {'morale': 15, 'gems': [], 'grails': 0}}
-        roles = [{'id': 'red1', 'name': '紅1', 'team': 'RED'}, {'id': 'red2', 'name': '紅2', 'team': 'RED'}, {'id': 'blue1', 'name': '藍1', 'team': 'BLUE'}, {'id': 'blue2', 'name': '藍2', 'team': 'BLUE'}]
-        random.shuffle(roles)
-        game_state['turn_order'] = [r['id'] for r in roles]
-        game_state['current_turn_idx'] = 0
-        game_state['phase'] = 'ACTION'
-        game_state['attack_chain'] = None
-        game_state['missile_chain'] = None
-        game_state['active_player_id'] = None
-        
-        txt = "🎮 遊戲開始！\n"
-        for r in roles:
-            # ★ 關鍵：若 draw_cards 失敗會觸發 init_deck 重試
-            hand = draw_cards_from_deck(4) 
-            players_db[r['id']] = {
-                'name': r['name'], 'team': r['team'], 'hand': hand,
-                'buffs': {'shield': 0, 'poison': False, 'weak': False}, 'heal_points': 0,
-                'energy': []
-            }
-            txt += f"{r['name']}: {r['team']}\n"
-        txt += f"\n👉 輪到 {roles[0]['name']}"
-        txt += f"\nhttps://liff.line.me/{LIFF_ID}"
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=txt))
-        return
-
-    # 解析指令
-    actor_id = None
-    real_msg = msg
-    
-    if msg.startswith("["):
-        try:
-            actor_name = msg.split("]")[0].replace("[", "")
-            actor_id = next((pid for pid, p in players_db.items() if p['name'] == actor_name), None)
-            if "]" in msg: real_msg = msg.split("]", 1)[1].strip()
-        except: pass
-
-    if not actor_id and game_state['active_player_id']: actor_id = game_state['active_player_id']
-    if not actor_id: return
-    actor = players_db[actor_id]
-    actor_name = actor['name']
-
-    # --- 階段處理 ---
-    if game_state['phase'] == 'CHOOSING_WEAKNESS':
-        if actor_id != game_state['active_player_id']: return
-        if "@摸牌" in real_msg:
-            cards = draw_cards_from_deck(3); actor['hand'].extend(cards); actor['buffs']['weak'] = False
-            game_state['phase'] = 'ACTION'
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"💫 {actor_name} 解除虛弱。\n👉 回合開始！"))
-            return
-        elif "@跳過" in real_msg:
-            actor['buffs']['weak'] = False; line_bot_api.reply_message(event.reply_token, TextSendMessage(text=next_turn(f"💫 {actor_name} 跳過回合。")))
-            return
-
-    if game_state['phase'] == 'DRAWING':
-        if actor_id != game_state['active_player_id']: return
-        if "@摸牌" in real_msg:
-            if game_state['pending_draw_count'] > 0:
-                card = draw_cards_from_deck(1)[0]; actor['hand'].append(card); game_state['pending_draw_count'] -= 1
-                if game_state['pending_draw_count'] > 0:
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"🎴 {actor_name} 摸牌 (剩 {game_state['pending_draw_count']} 張)"))
-                else:
-                    reply = check_discard_phase(actor_id, f"✅ {actor_name} 摸牌結束。")
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-            return
-
-    if game_state['phase'] == 'DISCARDING':
-        if actor_id != game_state['active_player_id']: return
-        if "棄牌" in real_msg:
-            try:
-                c_name = real_msg.split("[")[1].split("]")[0]
-                if c_name in actor['hand']:
-                    actor['hand'].remove(c_name); discard_pile.append(c_name); game_state['pending_draw_count'] -= 1
-                    if game_state['pending_draw_count'] > 0:
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"🗑️ {actor_name} 棄掉1張，剩 {game_state['pending_draw_count']} 張。"))
-                    else:
-                        reply = proceed_after_clean(f"🗑️ {actor_name} 棄牌完畢。")
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-            except: pass
-            return
-
-    # --- ACTION ---
-    if game_state['phase'] == 'ACTION':
-        if actor_id != get_current_player_id(): return 
-
-        # A. 購買
-        if "購買" in real_msg:
-            team = game_state['teams'][actor['team']]
-            if len(actor['hand']) + 3 > HAND_LIMIT:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"❌ 手牌將爆 ({len(actor['hand'])}+3>{HAND_LIMIT})")); return
-            if len(team['gems']) + 2 > GEM_LIMIT:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"❌ 能量將滿 ({len(team['gems'])}+2>{GEM_LIMIT})")); return
-            
-            drawn = draw_cards_from_deck(3); actor['hand'].extend(drawn)
-            add_gem(actor['team'], 'red')
-            add_gem(actor['team'], 'blue')
-            game_state['next_phase_after_clean'] = 'NEXT_TURN'
-            reply = check_discard_phase(actor_id, f"💰 {actor_name} 購買：摸3張，產紅藍能量。")
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-            return
-
-        # B. 合成
-        if "合成" in real_msg:
-            team = game_state['teams'][actor['team']]
-            if len(actor['hand']) + 3 > HAND_LIMIT:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 手牌將爆")); return
-            if len(team['gems']) < 3:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 能量不足3")); return
-            
-            del team['gems'][:3]; team['grails'] += 1
-            drawn = draw_cards_from_deck(3); actor['hand'].extend(drawn)
-            enemy = "BLUE" if actor['team']=="RED" else "RED"
-            game_state['teams'][enemy]['morale'] -= 1
-            
-            if team['grails'] >= WIN_GRAIL_COUNT or game_state['teams'][enemy]['morale'] <= 0:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"🏆 {actor_name} 合成！\n🎉 [{actor['team']}] 獲勝！")); return
-
-            game_state['next_phase_after_clean'] = 'NEXT_TURN'
-            reply = check_discard_phase(actor_id, f"⚗️ {actor_name} 合成：摸3張，產星杯，敵士氣-1。")
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-            return
-
-        # C. 提煉
-        if "提煉" in real_msg:
-            team = game_state['teams'][actor['team']]
-            if not team['gems']: line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 無能量")); return
-            cnt = min(2, len(team['gems'])); ext = []
-            for _ in range(cnt): g = team['gems'].pop(0); actor['energy'].append(g); ext.append(g)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=next_turn(f"⚡ {actor_name} 提煉了 {len(ext)} 顆能量。")))
-            return
-
-        # D. 卡牌
-        if "打出了 [" in real_msg:
-            parts = real_msg.split("]"); card_name = parts[0].split("[")[1]; target_id = None
-            if len(parts)>1 and ("攻擊" in parts[1] or "對" in parts[1]):
-                    target_name = parts[1].replace("攻擊", "").replace("對", "").strip()
-                    target_id = next((pid for pid, p in players_db.items() if p['name'] == target_name), None)
-            if card_name not in actor['hand']: return
-
-            if card_name == "魔彈":
-                actor['hand'].remove(card_name); discard_pile.append(card_name)
-                found = None; total = len(game_state['turn_order']); curr = game_state['turn_order'].index(actor_id)
-                for i in range(1, total):
-                    pid = game_state['turn_order'][(curr+i)%total]
-                    if players_db[pid]['team'] != actor['team']: found = pid; break
-                game_state['phase'] = 'RESOLVING_MISSILE'; game_state['missile_chain'] = {'damage': 2, 'target_id': found}
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"🔮 魔彈發射！鎖定 {players_db[found]['name']} (傷2)"))
-                return
-
-            if card_name in ["聖盾","中毒","虛弱"]:
-                if not target_id: return
-                actor['hand'].remove(card_name); discard_pile.append(card_name); target = players_db[target_id]
-                if card_name == "聖盾": 
-                    if target['buffs']['shield'] > 0: return
-                    target['buffs']['shield'] = 1
-                elif card_name == "中毒": target['buffs']['poison'] = True
-                elif card_name == "虛弱": target['buffs']['weak'] = True
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=next_turn(f"✨ {actor_name} 對 {target['name']} 使用 [{card_name}]")))
-                return
-
-            if "攻擊" in parts[1]:
-                if not target_id or actor['team'] == players_db[target_id]['team']: return
-                actor['hand'].remove(card_name); discard_pile.append(card_name)
-                c_data = CARD_MAP.get(card_name)
-                game_state['phase'] = 'RESOLVING'
-                game_state['attack_chain'] = {
-                    'damage': c_data['damage'], 'element': c_data['element'],
-                    'card_name': card_name, 'source_id': actor_id, 'source_name': actor_name, 'target_id': target_id
-                }
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"⚡ {actor_name} 攻擊 {players_db[target_id]['name']}！請應戰/承受"))
-                return
-
-    # RESOLVING
-    if game_state['phase'] == 'RESOLVING':
-        chain = game_state['attack_chain']
-        if actor_id != chain['target_id']: return
-        
-        if "承受" in real_msg:
-            target = players_db[actor_id]
-            if target['buffs']['shield'] > 0:
-                target['buffs']['shield'] = 0
-                reply = check_discard_phase(actor_id, f"🛡️ {actor_name} 消耗聖盾，抵銷了攻擊！")
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply)); return
-            
-            src_type = "attack" if chain['source_id'] == get_current_player_id() else "counter"
-            msg = resolve_damage_init(actor_id, chain['damage'], source_type=src_type)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg)); return
-
-        if "應戰 [" in real_msg:
-            resp_card = real_msg.split("[")[1].split("]")[0]
-            if resp_card == "聖光" and resp_card in actor['hand']:
-                actor['hand'].remove(resp_card); discard_pile.append(resp_card)
-                reply = check_discard_phase(actor_id, f"✨ {actor_name} 用聖光抵銷了攻擊！")
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply)); return
-            
-            if "對" in real_msg:
-                redirect_name = real_msg.split("對")[1].strip()
-                valid, reason = check_counter_validity(chain['element'], resp_card)
-                if valid:
-                     actor['hand'].remove(resp_card); discard_pile.append(resp_card)
-                     new_target_id = next((pid for pid, p in players_db.items() if p['name'] == redirect_name), None)
-                     if new_target_id == chain['source_id']: return
-                     chain['source_id'] = actor_id; chain['source_name'] = actor_name; chain['target_id'] = new_target_id
-                     if CARD_MAP[resp_card]['element'] == 'dark': chain['element'] = 'dark'
-                     line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"🔁 攻擊轉移給 {redirect_name} ({chain['element']})！"))
-
-    if game_state['phase'] == 'RESOLVING_MISSILE':
-        chain = game_state['missile_chain']
-        if actor_id != chain['target_id']: return
-        if "承受" in real_msg:
-            msg = resolve_damage_init(actor_id, chain['damage'], source_type="magic"); game_state['missile_chain'] = None
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg)); return
-        if "打出了 [" in real_msg:
-            c_name = real_msg.split("[")[1].split("]")[0]
-            if c_name in actor['hand'] and c_name in ["聖光", "聖盾", "魔彈"]:
-                actor['hand'].remove(c_name); discard_pile.append(c_name)
-                if c_name in ["聖光", "聖盾"]:
-                    game_state['missile_chain'] = None; reply = check_discard_phase(actor_id, f"✨ {actor_name} 用 [{c_name}] 抵銷魔彈！")
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply)); return
-                if c_name == "魔彈":
-                    found = None; total = len(game_state['turn_order']); curr = game_state['turn_order'].index(actor_id)
-                    for i in range(1, total):
-                        pid = game_state['turn_order'][(curr+i)%total]
-                        if players_db[pid]['team'] != actor['team']: found = pid; break
-                    chain['damage'] += 1; chain['target_id'] = found
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"🔮 {actor_name} 再度彈射魔彈！目標 {players_db[found]['name']} (傷{chain['damage']})"))
+    if cmd is None: cmd = parse_command(msg)
+    if cmd is None: return
+    t0 = time.perf_counter()
+    if profiler: profiler.begin(msg)
+    labels = ['-', 'NONE']
+    try:
+        # 規則在該桌的鎖內執行，回覆訊息在鎖外送出
+        reply = update_room(get_source_id(event.source), lambda room: apply_message(room, cmd, labels))
+        if reply: send_reply(event, reply)
+    finally:
+        if profiler: profiler.end()
+        MESSAGE_SECONDS.observe(time.perf_counter() - t0, *labels)
+
+def timed_apply(room, cmd):
+    """apply_command 並記錄耗時與洗牌次數"""
+    phase = room.state['phase']
+    t0 = time.perf_counter()
+    events = apply_command(room, cmd)
+    COMMAND_SECONDS.observe(time.perf_counter() - t0, phase, cmd.verb)
+    if events:
+        reshuffles = sum(1 for e in events if e['type'] == 'RESHUFFLE')
+        if reshuffles: RESHUFFLES.inc(amount=reshuffles)
+    return events
+
+def apply_message(room, cmd, labels=None):
+    """套用一則已解析的聊天指令，回傳回覆文字 (None 代表指令無效)"""
+    if labels is not None: labels[:] = [room.state['phase'], cmd.verb]
+    events = timed_apply(room, cmd)
+    if not events: return None
+    reply = render_events(room, events)
+    if cmd.verb == 'START': reply += f"\n{liff_url(room.room_id)}"
+    return reply
 
 if __name__ == "__main__":
+    warm_worker()
     app.run()
\ No newline at end of file
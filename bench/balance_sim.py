@@ -0,0 +1,271 @@
+"""牌組平衡蒙地卡羅模擬 (NumPy 批次：數萬局以陣列同步推進)。
+
+    pip install numpy
+    python bench/balance_sim.py --games 20000 --hand-limit 5 6 7 --win-grails 4 5
+    python bench/balance_sim.py --count atk_dark=3,5,8 --count def_light=3,5 --json
+
+抽牌/洗牌與 GameRoom.draw_cards_from_deck 相同 (從牌堆頂抽，牌堆空時把棄牌堆洗回)，
+傷害/產石與 resolve_damage_init 相同 (受傷方的敵隊得一顆石，受傷方摸等量的牌，超過
+手牌上限就隨機棄牌)。行動策略是簡化的啟發式：能合成就合成，否則依 --p-attack 機率攻擊，
+再來購買、提煉。聖盾/魔彈/中毒/虛弱不會被打出；應戰最多轉移一次。
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import CARD_DB_LIST, HAND_LIMIT, GEM_LIMIT, WIN_GRAIL_COUNT, LIGHT
+
+N_CARDS = len(CARD_DB_LIST)
+IS_ATTACK = np.array([c['type'] == 'attack' for c in CARD_DB_LIST])
+ELEMENTS = sorted({c['element'] for c in CARD_DB_LIST})
+ELEMENT_OF = np.array([ELEMENTS.index(c['element']) for c in CARD_DB_LIST])
+DARK = ELEMENTS.index('dark')
+START_MORALE = 15
+
+
+class Batch:
+    """n 局同時進行的狀態 (每個欄位第一維都是局號)"""
+
+    def __init__(self, n, counts, hand_limit, gem_limit, win_grails, rng):
+        self.n, self.rng = n, rng
+        self.hand_limit, self.gem_limit, self.win_grails = hand_limit, gem_limit, win_grails
+        full = np.repeat(np.arange(N_CARDS, dtype=np.int8), counts)
+        self.size = len(full)
+        self.deck = np.take_along_axis(np.tile(full, (n, 1)), np.argsort(rng.random((n, self.size)), axis=1), axis=1)
+        self.deck_n = np.full(n, self.size)
+        self.disc = np.zeros((n, self.size), dtype=np.int8)
+        self.disc_n = np.zeros(n, dtype=np.int64)
+        self.hand = np.zeros((n, 4, N_CARDS), dtype=np.int16)
+        self.hand_size = np.zeros((n, 4), dtype=np.int64)
+        # 座位隊伍隨機 (與 @測試開局 打亂座位相同)
+        self.team_of = np.take_along_axis(np.tile([0, 0, 1, 1], (n, 1)), np.argsort(rng.random((n, 4)), axis=1), axis=1)
+        self.gems = np.zeros((n, 2), dtype=np.int64)
+        self.morale = np.full((n, 2), START_MORALE)
+        self.grails = np.zeros((n, 2), dtype=np.int64)
+        self.cur = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self.winner = np.full(n, -1)
+        self.turns = np.zeros(n, dtype=np.int64)
+        self.reshuffles = np.zeros(n, dtype=np.int64)
+        self.rows = np.arange(n)
+
+        everyone = np.ones(n, dtype=bool)
+        for seat in range(4):
+            self.draw(everyone, np.full(n, seat), 4)
+
+    # --- 牌堆 ---
+
+    def reshuffle(self, need):
+        """牌堆空了：把棄牌堆洗成新牌堆"""
+        idx = np.nonzero(need)[0]
+        sub, cnt = self.disc[idx], self.disc_n[idx]
+        keys = self.rng.random(sub.shape)
+        keys[np.arange(self.size)[None, :] >= cnt[:, None]] = 2.0   # 無效位置排到最後
+        self.deck[idx] = np.take_along_axis(sub, np.argsort(keys, axis=1), axis=1)
+        self.deck_n[idx] = cnt
+        self.disc_n[idx] = 0
+        self.reshuffles[idx] += 1
+
+    def draw(self, mask, seat, count):
+        """mask 中每局的 seat 玩家摸 count 張 (count 可為每局不同的陣列)"""
+        count = np.broadcast_to(count, (self.n,))
+        for i in range(int(count[mask].max(initial=0))):
+            m = mask & (count > i)
+            need = m & (self.deck_n == 0)
+            if need.any(): self.reshuffle(need)
+            idx = np.nonzero(m & (self.deck_n > 0))[0]
+            top = self.deck_n[idx] - 1
+            cards = self.deck[idx, top]
+            self.deck_n[idx] = top
+            self.hand[idx, seat[idx], cards] += 1
+            self.hand_size[idx, seat[idx]] += 1
+
+    def discard(self, idx, cards):
+        self.disc[idx, self.disc_n[idx]] = cards
+        self.disc_n[idx] += 1
+
+    def take_random(self, idx, seat, allowed=None):
+        """從手牌隨機拿出一張 (可限定卡種)，放入棄牌堆並回傳卡號"""
+        counts = self.hand[idx, seat].astype(np.int64)
+        if allowed is not None: counts = counts * allowed
+        total = counts.sum(axis=1)
+        r = (self.rng.random(len(idx)) * total).astype(np.int64)
+        cards = np.argmax(counts.cumsum(axis=1) > r[:, None], axis=1)
+        self.hand[idx, seat, cards] -= 1
+        self.hand_size[idx, seat] -= 1
+        self.discard(idx, cards.astype(np.int8))
+        return cards
+
+    def discard_excess(self, mask, seat):
+        """與 check_discard_phase 相同：超過手牌上限就棄到上限 (隨機棄)"""
+        while True:
+            idx = np.nonzero(mask & (self.hand_size[self.rows, seat] > self.hand_limit))[0]
+            if not len(idx): return
+            self.take_random(idx, seat[idx])
+
+    # --- 規則 ---
+
+    def damage(self, mask, victim, amount):
+        """與 resolve_damage_init 相同：受傷方敵隊得石 -> 受傷方摸牌 -> 棄牌"""
+        idx = np.nonzero(mask)[0]
+        enemy = 1 - self.team_of[idx, victim[idx]]
+        self.gems[idx, enemy] = np.minimum(self.gems[idx, enemy] + 1, self.gem_limit)
+        self.draw(mask, victim, amount)
+        self.discard_excess(mask, victim)
+
+    def random_enemy(self, team, exclude=None):
+        keys = self.rng.random((self.n, 4))
+        keys[self.team_of == team[:, None]] = -1
+        if exclude is not None: keys[self.rows, exclude] = -1
+        return np.argmax(keys, axis=1)
+
+    def step(self, p_attack, p_block, p_counter):
+        act = ~self.done
+        rows, seat = self.rows, self.cur
+        team = self.team_of[rows, seat]
+        hs = self.hand_size[rows, seat]
+        gem = self.gems[rows, team]
+        my_hand = self.hand[rows, seat]
+
+        has_atk = my_hand[:, IS_ATTACK].sum(axis=1) > 0
+        do_synth = act & (hs + 3 <= self.hand_limit) & (gem >= 3)
+        rest = act & ~do_synth
+        do_atk = rest & has_atk & (self.rng.random(self.n) < p_attack)
+        rest &= ~do_atk
+        do_buy = rest & (hs + 3 <= self.hand_limit) & (gem + 2 <= self.gem_limit)
+        rest &= ~do_buy
+        do_ext = rest & (gem > 0)
+        rest &= ~do_ext
+        do_atk |= rest & has_atk
+
+        # 合成
+        if do_synth.any():
+            idx = np.nonzero(do_synth)[0]
+            t = team[idx]
+            self.gems[idx, t] -= 3
+            self.grails[idx, t] += 1
+            self.morale[idx, 1 - t] -= 1
+            self.draw(do_synth, seat, 3)
+            won = np.zeros(self.n, dtype=bool)
+            won[idx] = (self.grails[idx, t] >= self.win_grails) | (self.morale[idx, 1 - t] <= 0)
+            self.done |= won
+            self.winner[won] = team[won]
+            self.discard_excess(do_synth & ~won, seat)
+
+        # 購買
+        if do_buy.any():
+            idx = np.nonzero(do_buy)[0]
+            self.gems[idx, team[idx]] = np.minimum(self.gems[idx, team[idx]] + 2, self.gem_limit)
+            self.draw(do_buy, seat, 3)
+            self.discard_excess(do_buy, seat)
+
+        # 提煉
+        if do_ext.any():
+            idx = np.nonzero(do_ext)[0]
+            self.gems[idx, team[idx]] -= np.minimum(2, self.gems[idx, team[idx]])
+
+        # 攻擊 -> (聖光抵銷 | 應戰轉移一次 | 承受)
+        if do_atk.any():
+            idx = np.nonzero(do_atk)[0]
+            card = np.zeros(self.n, dtype=np.int64)
+            card[idx] = self.take_random(idx, seat[idx], IS_ATTACK)
+            elem = ELEMENT_OF[card]
+            victim = self.random_enemy(team)
+
+            v_hand = self.hand[rows, victim]
+            blocked = do_atk & (v_hand[:, LIGHT] > 0) & (self.rng.random(self.n) < p_block)
+            if blocked.any():
+                b = np.nonzero(blocked)[0]
+                self.hand[b, victim[b], LIGHT] -= 1
+                self.hand_size[b, victim[b]] -= 1
+                self.discard(b, np.full(len(b), LIGHT, dtype=np.int8))
+
+            same = IS_ATTACK[None, :] & ((ELEMENT_OF[None, :] == elem[:, None]) | (ELEMENT_OF[None, :] == DARK))
+            can_counter = (elem != DARK) & ((v_hand * same).sum(axis=1) > 0)
+            countered = do_atk & ~blocked & can_counter & (self.rng.random(self.n) < p_counter)
+            if countered.any():
+                c = np.nonzero(countered)[0]
+                self.take_random(c, victim[c], same[c])
+                victim = np.where(countered, self.random_enemy(1 - team, exclude=seat), victim)
+
+            self.damage(do_atk & ~blocked, victim, 2)
+
+        self.turns += act
+        self.cur = np.where(act, (seat + 1) % 4, seat)
+
+
+def simulate(games, counts, hand_limit, gem_limit, win_grails, seed, max_turns, p_attack, p_block, p_counter):
+    rng = np.random.default_rng(seed)
+    b = Batch(games, counts, hand_limit, gem_limit, win_grails, rng)
+    for _ in range(max_turns):
+        if b.done.all(): break
+        b.step(p_attack, p_block, p_counter)
+
+    finished = b.done
+    turns = b.turns[finished]
+    first_team = b.team_of[:, 0]
+    return {
+        'games': games,
+        'finished': round(float(finished.mean()), 4),
+        'red_win': round(float((b.winner == 0).mean()), 4),
+        'blue_win': round(float((b.winner == 1).mean()), 4),
+        'first_seat_team_win': round(float((b.winner[finished] == first_team[finished]).mean()) if finished.any() else 0.0, 4),
+        'turns_p10': int(np.percentile(turns, 10)) if len(turns) else None,
+        'turns_p50': int(np.percentile(turns, 50)) if len(turns) else None,
+        'turns_p90': int(np.percentile(turns, 90)) if len(turns) else None,
+        'reshuffles_per_game': round(float(b.reshuffles.mean()), 2),
+        'reshuffles_per_100_turns': round(float(b.reshuffles.sum() / max(1, b.turns.sum()) * 100), 2),
+    }
+
+
+def parse_counts(specs):
+    """--count atk_dark=3,5 -> {'atk_dark': [3, 5]}"""
+    out = {}
+    for spec in specs or []:
+        key, values = spec.split('=', 1)
+        if key not in {c['id'] for c in CARD_DB_LIST}: raise SystemExit(f"未知卡牌 id: {key}")
+        out[key] = [int(v) for v in values.split(',')]
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--games', type=int, default=20000)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--max-turns', type=int, default=600)
+    ap.add_argument('--hand-limit', type=int, nargs='+', default=[HAND_LIMIT])
+    ap.add_argument('--gem-limit', type=int, nargs='+', default=[GEM_LIMIT])
+    ap.add_argument('--win-grails', type=int, nargs='+', default=[WIN_GRAIL_COUNT])
+    ap.add_argument('--count', action='append', help='卡牌張數，如 atk_dark=3,5,8 (可重複)')
+    ap.add_argument('--p-attack', type=float, default=0.7)
+    ap.add_argument('--p-block', type=float, default=0.8, help='有聖光時使用的機率')
+    ap.add_argument('--p-counter', type=float, default=0.5, help='能應戰時轉移的機率')
+    ap.add_argument('--json', action='store_true')
+    opts = ap.parse_args()
+
+    count_grid = parse_counts(opts.count)
+    card_keys = list(count_grid)
+    grid = itertools.product(opts.hand_limit, opts.gem_limit, opts.win_grails, *[count_grid[k] for k in card_keys])
+
+    results = []
+    for hand_limit, gem_limit, win_grails, *overrides in grid:
+        override = dict(zip(card_keys, overrides))
+        counts = [override.get(c['id'], c['count']) for c in CARD_DB_LIST]
+        t0 = time.perf_counter()
+        stats = simulate(opts.games, counts, hand_limit, gem_limit, win_grails, opts.seed, opts.max_turns, opts.p_attack, opts.p_block, opts.p_counter)
+        row = {'hand_limit': hand_limit, 'gem_limit': gem_limit, 'win_grails': win_grails, **override, **stats, 'seconds': round(time.perf_counter() - t0, 2)}
+        results.append(row)
+        if not opts.json: print(' '.join(f"{k}={v}" for k, v in row.items()), flush=True)
+
+    if opts.json: print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
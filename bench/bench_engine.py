@@ -0,0 +1,111 @@
+"""規則引擎吞吐量基準測試：以固定亂數種子跑大量隨機合法對局。
+
+    python bench/bench_engine.py --games 100000 --seed 1 --workers 4
+    python bench/bench_engine.py --games 20000 --save bench/baseline.json
+    python bench/bench_engine.py --games 20000 --baseline bench/baseline.json --tolerance 0.15
+
+回報 games/sec、commands/sec 與每個指令的 p50/p99 延遲；指定 --baseline 時，
+commands/sec 低於基準超過容許比例就以非零狀態結束 (可用於發版前的效能關卡)。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import GameRoom
+from commands import Command, apply_command, legal_commands
+
+# 延遲樣本上限 (蓄水池抽樣，避免大量對局時記憶體無限成長)
+SAMPLE_SIZE = 200000
+
+
+def play_games(args):
+    """跑 n 局隨機合法對局，回傳統計 (在子行程中執行)"""
+    n_games, seed, max_commands = args
+    rng = random.Random(seed)      # 各局的洗牌種子與選擇指令用
+    sampler = random.Random(seed ^ 0x5EED)
+    samples = []
+    seen = commands = finished = 0
+    clock = time.perf_counter_ns
+
+    start = time.perf_counter()
+    for g in range(n_games):
+        room = GameRoom(f"bench-{seed}-{g}", rng.getrandbits(63))
+        apply_command(room, Command('START', None, None, None))
+        for _ in range(max_commands):
+            options = legal_commands(room)
+            if not options: break
+            cmd = rng.choice(options)
+            t0 = clock()
+            apply_command(room, cmd)
+            dt = clock() - t0
+            commands += 1
+            seen += 1
+            if len(samples) < SAMPLE_SIZE: samples.append(dt)
+            else:
+                j = sampler.randrange(seen)
+                if j < SAMPLE_SIZE: samples[j] = dt
+        if room.state['phase'] == 'FINISHED': finished += 1
+    elapsed = time.perf_counter() - start
+    return {'games': n_games, 'commands': commands, 'finished': finished, 'elapsed': elapsed, 'samples': samples}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values: return 0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--games', type=int, default=1000)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--workers', type=int, default=1)
+    ap.add_argument('--max-commands', type=int, default=3000, help='單局指令上限 (避免隨機對局無限進行)')
+    ap.add_argument('--save', help='把結果存成 JSON (作為之後的基準)')
+    ap.add_argument('--baseline', help='與此 JSON 基準比較 commands/sec')
+    ap.add_argument('--tolerance', type=float, default=0.10, help='允許低於基準的比例')
+    opts = ap.parse_args()
+
+    per_worker = [opts.games // opts.workers + (1 if i < opts.games % opts.workers else 0) for i in range(opts.workers)]
+    jobs = [(n, opts.seed + i, opts.max_commands) for i, n in enumerate(per_worker) if n]
+
+    wall = time.perf_counter()
+    if opts.workers > 1:
+        with Pool(opts.workers) as pool: parts = pool.map(play_games, jobs)
+    else:
+        parts = [play_games(job) for job in jobs]
+    wall = time.perf_counter() - wall
+
+    games = sum(p['games'] for p in parts)
+    commands = sum(p['commands'] for p in parts)
+    finished = sum(p['finished'] for p in parts)
+    samples = sorted(s for p in parts for s in p['samples'])
+    result = {
+        'games': games, 'commands': commands, 'finished': finished, 'seed': opts.seed, 'workers': opts.workers,
+        'wall_seconds': round(wall, 3),
+        'games_per_sec': round(games / wall, 1),
+        'commands_per_sec': round(commands / wall, 1),
+        'p50_us': round(percentile(samples, 0.50) / 1000, 2),
+        'p99_us': round(percentile(samples, 0.99) / 1000, 2),
+    }
+    print(json.dumps(result, indent=2))
+
+    if opts.save:
+        with open(opts.save, 'w') as f: json.dump(result, f, indent=2)
+
+    if opts.baseline:
+        with open(opts.baseline) as f: base = json.load(f)
+        floor = base['commands_per_sec'] * (1 - opts.tolerance)
+        if result['commands_per_sec'] < floor:
+            print(f"REGRESSION: {result['commands_per_sec']} commands/sec < {floor:.1f} (baseline {base['commands_per_sec']})")
+            sys.exit(1)
+        print(f"OK: within {opts.tolerance:.0%} of baseline {base['commands_per_sec']} commands/sec")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Webhook 壓力測試：模擬多桌玩家送出已簽章的 LINE webhook，並輪詢 /api/my_status。
+
+    python tools/line_stub.py --port 8081 --latency-ms 30 &
+    CHANNEL_SECRET=test CHANNEL_ACCESS_TOKEN=test LINE_API_URL=http://127.0.0.1:8081 \\
+    RATE_USER_PER_SEC=0 RATE_GAME_PER_SEC=0 RATE_API_PER_SEC=0 RATE_API_GAME_PER_SEC=0 \\
+        gunicorn -w 1 --threads 32 -b 127.0.0.1:8000 app:app
+    python bench/load_webhook.py --url http://127.0.0.1:8000 --secret test --tables 50 --rate 100 --duration 30 \\
+        --stub-url http://127.0.0.1:8081
+
+多個 worker (-w 4) 時同一桌的請求可能落在不同行程，伺服器需用 GAME_STORE=sqlite 或 redis；本工具不用改。
+壓測伺服器本身時把限流關掉 (RATE_*=0，如上)：本工具每 --poll-ms 輪詢一次，遠超過 /api 的預設上限。
+沒關時 429 會依 Retry-After 等待後重試，並在報告中另計為 throttled (不算錯誤，也不計入延遲)；
+聊天指令被限流時伺服器仍回 200 但不處理，會出現在 apply 的 timeout 裡。
+
+每桌一條執行緒：讀取輪到誰 -> 依該玩家手牌挑一個合理指令 (開局/購買/合成/提煉/攻擊/應戰/承受/摸牌/棄牌)
+-> 以 CHANNEL_SECRET 做 HMAC-SHA256 簽章後 POST /callback -> 以 ETag 輪詢 /api/my_status 直到版本前進。
+--rate 是所有桌合計每秒送出的指令數。報告各端點的吞吐量、延遲百分位數與錯誤數；
+apply 為 webhook 送出到狀態版本前進的時間 (含伺服器佇列與規則執行)。
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import CARD_MAP, TEST_ROLES, check_counter_validity, CARD_INDEX
+
+
+def sign(secret, body):
+    """與 WebhookParser 驗證的方式相同：base64(HMAC-SHA256(channel secret, body))"""
+    return base64.b64encode(hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()).decode('ascii')
+
+
+def webhook_body(group_id, user_id, text):
+    event = {
+        'type': 'message', 'mode': 'active', 'timestamp': int(time.time() * 1000),
+        'source': {'type': 'group', 'groupId': group_id, 'userId': user_id},
+        'webhookEventId': uuid.uuid4().hex, 'deliveryContext': {'isRedelivery': False},
+        'replyToken': uuid.uuid4().hex,
+        'message': {'type': 'text', 'id': str(random.getrandbits(60)), 'quoteToken': uuid.uuid4().hex, 'text': text},
+    }
+    return json.dumps({'destination': 'Uload', 'events': [event]}, ensure_ascii=False).encode('utf-8')
+
+
+def choose_command(view, rng):
+    """依目前有操作權玩家的視角挑一個指令文字 (與真人會打的格式相同)"""
+    phase = view['game_phase']
+    name = view['name']
+    hand = view['hand']
+    players = view['all_players']
+    enemies = [p['name'] for p in players if p['team'] != view['team']]
+    gems = len(view['teams'][view['team']]['gems'])
+
+    if phase in ('WAITING', 'FINISHED'): return "@測試開局"
+    if phase == 'DRAWING': return f"[{name}] @摸牌"
+    if phase == 'CHOOSING_WEAKNESS': return f"[{name}] {rng.choice(['@摸牌', '@跳過'])}"
+    if phase == 'DISCARDING': return f"[{name}] 棄牌 [{rng.choice(hand)}]"
+
+    if phase == 'RESOLVING':
+        attack = view['incoming_attack']
+        counters = [c for c in hand if check_counter_validity(attack['element'], CARD_INDEX[c])[0]]
+        if counters and rng.random() < 0.5:
+            card = rng.choice(counters)
+            if card == '聖光': return f"[{name}] 應戰 [{card}]"
+            targets = [p for p in enemies if p != attack['source_name']]
+            if targets: return f"[{name}] 應戰 [{card}] 對 {rng.choice(targets)}"
+        return f"[{name}] 承受"
+
+    if phase == 'RESOLVING_MISSILE':
+        blocks = [c for c in hand if c in ('聖光', '聖盾', '魔彈')]
+        if blocks and rng.random() < 0.5: return f"[{name}] 打出了 [{rng.choice(blocks)}]"
+        return f"[{name}] 承受"
+
+    # ACTION
+    attacks = [c for c in hand if CARD_MAP[c]['type'] == 'attack']
+    if gems >= 3 and len(hand) <= 3: return f"[{name}] 合成"
+    if attacks and rng.random() < 0.7: return f"[{name}] 打出了 [{rng.choice(attacks)}] 攻擊 {rng.choice(enemies)}"
+    magic = [c for c in hand if c in ('中毒', '虛弱', '聖盾', '魔彈')]
+    if magic and rng.random() < 0.3:
+        card = rng.choice(magic)
+        if card == '魔彈': return f"[{name}] 打出了 [魔彈]"
+        target = view['name'] if card == '聖盾' else rng.choice(enemies)
+        return f"[{name}] 打出了 [{card}] 對 {target}"
+    if len(hand) <= 3 and gems <= 3: return f"[{name}] 購買"
+    if gems: return f"[{name}] 提煉"
+    if attacks: return f"[{name}] 打出了 [{rng.choice(attacks)}] 攻擊 {rng.choice(enemies)}"
+    return f"[{name}] 購買"
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.errors = {}
+        self.throttled = {}
+
+    def ok(self, endpoint, seconds):
+        with self.lock: self.latency.setdefault(endpoint, []).append(seconds)
+
+    def error(self, endpoint, kind):
+        with self.lock:
+            errs = self.errors.setdefault(endpoint, {})
+            errs[kind] = errs.get(kind, 0) + 1
+
+    def throttle(self, endpoint):
+        with self.lock: self.throttled[endpoint] = self.throttled.get(endpoint, 0) + 1
+
+
+class Table:
+    """一桌：自己的 HTTP 連線 (keep-alive)、群組 ID 與亂數"""
+
+    def __init__(self, index, opts, stats):
+        self.opts = opts
+        self.stats = stats
+        self.group_id = f"C{opts.prefix}{index:05d}"
+        self.rng = random.Random(opts.seed * 100003 + index)
+        self.session = requests.Session()
+        self.etag = None
+        self.view = None
+
+    def throttled(self, endpoint, r):
+        """被限流 (429) 時記錄並依 Retry-After 等待，回傳 True 代表要重送"""
+        if r.status_code != 429: return False
+        self.stats.throttle(endpoint)
+        try: wait = float(r.headers.get('Retry-After', 1))
+        except ValueError: wait = 1
+        time.sleep(wait)
+        return True
+
+    def callback(self, text):
+        body = webhook_body(self.group_id, 'Uload' + self.group_id, text)
+        headers = {'Content-Type': 'application/json', 'X-Line-Signature': sign(self.opts.secret, body)}
+        while True:
+            t0 = time.perf_counter()
+            try:
+                r = self.session.post(self.opts.url + '/callback', data=body, headers=headers, timeout=self.opts.timeout)
+            except requests.RequestException as e:
+                return self.stats.error('callback', type(e).__name__)
+            if not self.throttled('callback', r): break
+        if r.status_code != 200: return self.stats.error('callback', str(r.status_code))
+        self.stats.ok('callback', time.perf_counter() - t0)
+
+    def status(self, pid, conditional=False):
+        """取某位玩家視角；conditional 時帶 ETag (沒變回 None)"""
+        headers = {'If-None-Match': self.etag} if conditional and self.etag else {}
+        while True:
+            t0 = time.perf_counter()
+            try:
+                r = self.session.get(self.opts.url + '/api/my_status', params={'room': self.group_id, 'simulate_id': pid}, headers=headers, timeout=self.opts.timeout)
+            except requests.RequestException as e:
+                return self.stats.error('my_status', type(e).__name__)
+            if not self.throttled('my_status', r): break
+        self.stats.ok('my_status', time.perf_counter() - t0)
+        if r.status_code == 304: return None
+        if r.status_code != 200: return self.stats.error('my_status', str(r.status_code))
+        data = r.json()
+        if 'error' in data: return None
+        self.etag = r.headers.get('ETag')
+        return data
+
+    def wait_version(self, pid, version, sent_at):
+        """輪詢直到版本前進 (記錄 apply 延遲)；逾時代表指令沒有生效或伺服器太慢"""
+        deadline = time.monotonic() + self.opts.apply_timeout
+        while time.monotonic() < deadline:
+            view = self.status(pid, conditional=True)
+            if view and view['version'] != version:
+                self.stats.ok('apply', time.perf_counter() - sent_at)
+                return view
+            time.sleep(self.opts.poll_ms / 1000)
+        self.stats.error('apply', 'timeout')
+        return None
+
+    def run(self, stop_at):
+        interval = self.opts.tables / self.opts.rate
+        next_at = time.monotonic() + self.rng.random() * interval
+        owner = TEST_ROLES[0]['id']
+        view = None
+        while True:
+            now = time.monotonic()
+            if next_at > now: time.sleep(next_at - now)
+            if time.monotonic() >= stop_at: return
+            next_at += interval
+
+            # 先看輪到誰，再取那位玩家的視角 (手牌)
+            if view is None or view['my_id'] != view.get('turn_owner_id'):
+                view = self.status(owner)
+                if view and view.get('turn_owner_id') and view['turn_owner_id'] != owner:
+                    owner = view['turn_owner_id']
+                    view = self.status(owner)
+            text = choose_command(view, self.rng) if view else "@測試開局"
+            version = view['version'] if view else 0
+
+            sent_at = time.perf_counter()
+            self.callback(text)
+            view = self.wait_version(owner, version, sent_at)
+            if view and view.get('turn_owner_id'): owner = view['turn_owner_id']
+
+
+def summarize(stats, wall):
+    out = {}
+    for endpoint in sorted(set(stats.latency) | set(stats.errors) | set(stats.throttled)):
+        values = sorted(stats.latency.get(endpoint, []))
+        pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2) if values else None
+        out[endpoint] = {
+            'ok': len(values), 'per_sec': round(len(values) / wall, 1),
+            'p50_ms': pick(0.50), 'p90_ms': pick(0.90), 'p99_ms': pick(0.99), 'max_ms': round(values[-1] * 1000, 2) if values else None,
+            'errors': stats.errors.get(endpoint, {}), 'throttled': stats.throttled.get(endpoint, 0),
+        }
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--url', default='http://127.0.0.1:8000')
+    ap.add_argument('--secret', default=os.environ.get('CHANNEL_SECRET', 'test'))
+    ap.add_argument('--tables', type=int, default=20)
+    ap.add_argument('--rate', type=float, default=50, help='所有桌合計每秒指令數')
+    ap.add_argument('--duration', type=float, default=30, help='秒')
+    ap.add_argument('--poll-ms', type=float, default=20, help='等待版本前進時的輪詢間隔')
+    ap.add_argument('--apply-timeout', type=float, default=5)
+    ap.add_argument('--timeout', type=float, default=10, help='單一 HTTP 請求逾時')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--prefix', default=None, help='群組 ID 前綴 (預設每次執行不同，避免接續上次的牌局)')
+    ap.add_argument('--stub-url', help='LINE API 替身位址：結束時一併回報它收到的訊息數')
+    opts = ap.parse_args()
+    if opts.prefix is None: opts.prefix = f"load{int(time.time()) % 100000}x"
+
+    if opts.stub_url: requests.post(opts.stub_url + '/stats/reset', timeout=5)
+    stats = Stats()
+    tables = [Table(i, opts, stats) for i in range(opts.tables)]
+    start = time.monotonic()
+    stop_at = start + opts.duration
+    threads = [threading.Thread(target=t.run, args=(stop_at,), daemon=True) for t in tables]
+    for th in threads: th.start()
+    for th in threads: th.join(opts.duration + opts.apply_timeout + opts.timeout * 3)
+    wall = time.monotonic() - start
+
+    report = {'tables': opts.tables, 'target_rate': opts.rate, 'wall_seconds': round(wall, 2), 'endpoints': summarize(stats, wall)}
+    if opts.stub_url: report['line_stub'] = requests.get(opts.stub_url + '/stats', timeout=5).json()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
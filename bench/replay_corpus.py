@@ -0,0 +1,243 @@
+"""對局語料重播：以相同的種子與指令序列重播已錄下的對局，檢查最終狀態是否一致、每個指令的耗時是否退步。
+
+    python bench/replay_corpus.py generate --games 12 --seed 1              # 產生隨機合法對局加入語料
+    python bench/replay_corpus.py record --journal game_journal --room C1234 # 從線上日誌擷取該桌的對局
+    python bench/replay_corpus.py check --save-baseline                      # 在基準機器上存下耗時基準
+    python bench/replay_corpus.py check --tolerance 0.25                     # 改動熱路徑後比較
+
+語料 (bench/corpus/games.jsonl) 一行一局：{"name", "seed", "shuffles", "commands": [[verb, actor, card, target], ...], "final"}。
+重播 = GameRoom(種子) 並把已洗牌次數設為開局前的值，再依序套用指令；final 是最終狀態 (不含桌號與版本) 的 SHA-256。
+check 在最終狀態不同、或某個指令動詞的 p50 耗時超過基準 (1 + tolerance) 倍時以非零狀態結束；
+刻意改變規則行為後用 check --accept 更新 final。每次重播的前後都跑一段固定的純 Python 工作量，把該次耗時換算成基準的 CPU 速度
+(頻率調整、其他行程的干擾在量測期間變化也能抵銷)；換了 Python 版本請重新 --save-baseline。
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import GameRoom
+from commands import Command, apply_command, legal_commands
+from journal import Journal, read_entries
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+# 耗時差距小於此微秒數時不算退步 (計時雜訊)
+MIN_DELTA_US = 1.0
+
+
+def digest(room):
+    """最終狀態的指紋 (不含桌號與版本，同一局在任何桌號重播都相同)"""
+    data = room.to_dict()
+    del data['room_id'], data['version']
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def replay(game, timings=None):
+    """重播一局，回傳最終的 room；timings 給定時依動詞收集每個指令的耗時 (奈秒)"""
+    room = GameRoom('corpus', game['seed'])
+    room.shuffles = game['shuffles']
+    clock = time.perf_counter_ns
+    for i, c in enumerate(game['commands']):
+        cmd = Command(*c)
+        t0 = clock()
+        events = apply_command(room, cmd)
+        dt = clock() - t0
+        if events is None: raise ValueError(f"{game['name']}: 第 {i} 個指令 {c} 未被接受")
+        if timings is not None: timings.setdefault(cmd.verb, []).append(dt)
+    return room
+
+
+# --- 錄製 ---
+
+def generate(n_games, seed, max_commands):
+    """以固定種子跑隨機合法對局；能合成時一定合成，讓對局能在上限內分出勝負"""
+    rng = random.Random(seed)
+    games = []
+    for g in range(n_games):
+        room = GameRoom('corpus', rng.getrandbits(63))
+        game = {'name': f"random-{seed}-{g}", 'seed': room.seed, 'shuffles': room.shuffles, 'commands': [['START', None, None, None]]}
+        apply_command(room, Command('START', None, None, None))
+        for _ in range(max_commands):
+            options = legal_commands(room)
+            if not options: break
+            synth = [c for c in options if c.verb == 'SYNTH']
+            cmd = synth[0] if synth else rng.choice(options)
+            apply_command(room, cmd)
+            game['commands'].append(list(cmd))
+        game['final'] = digest(room)
+        games.append(game)
+    return games
+
+
+def record(path, room_id):
+    """從日誌擷取某一桌每次開局之後的指令 (開局前的種子與洗牌次數由重播日誌得到)"""
+    journal = Journal(path)
+    snapshots = journal._list('snapshot')
+    start = snapshots[-1] if snapshots else 0
+    room = None
+    if snapshots:
+        for entry in read_entries(journal._file('snapshot', start)):
+            if entry['room_id'] == room_id: room = GameRoom.from_dict(entry)
+    games = []
+    for seq in journal._list('log'):
+        if seq < start: continue
+        for entry in read_entries(journal._file('log', seq)):
+            if entry['r'] != room_id: continue
+            if room is None: room = GameRoom(room_id, entry.get('s'))
+            if entry['v'] <= room.version: continue
+            cmd = Command(*entry['c'])
+            if cmd.verb == 'START':
+                games.append({'name': f"{room_id}-v{entry['v']}", 'seed': room.seed, 'shuffles': room.shuffles, 'commands': []})
+            apply_command(room, cmd)
+            room.version = entry['v']
+            if games: games[-1]['commands'].append(list(cmd))
+    # 快照之前就開局的對局缺了前段，無法擷取
+    for game in games: game['final'] = digest(replay(game))
+    return games
+
+
+def load_corpus(path):
+    if not os.path.exists(path): return []
+    with open(path, encoding='utf-8') as f: return [json.loads(line) for line in f if line.strip()]
+
+
+def save_corpus(path, games):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for game in games: f.write(json.dumps(game, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+
+def add_games(path, games):
+    """加入語料 (同名的對局會被取代)"""
+    names = {g['name'] for g in games}
+    corpus = [g for g in load_corpus(path) if g['name'] not in names] + games
+    save_corpus(path, corpus)
+    print(f"{len(games)} games added, corpus has {len(corpus)} games ({sum(len(g['commands']) for g in corpus)} commands)")
+
+
+# --- 檢查 ---
+
+def calibrate(rounds=5):
+    """固定的純 Python 工作量 (微秒，取最快一次)：用來把不同機器/時段的 CPU 速度差異換算掉"""
+    best = None
+    for _ in range(rounds):
+        t0 = time.perf_counter_ns()
+        d = {}
+        for i in range(20000):
+            d[i & 255] = d.get(i & 255, 0) + len(str(i))
+        best = min(best or float('inf'), time.perf_counter_ns() - t0)
+    return round(best / 1000, 1)
+
+
+def measure(corpus, repeat, reference_us):
+    """每局重播 repeat 次，每個指令取最快的一次 (去掉排程與快取雜訊)，依動詞統計 p50/p99 (微秒)。
+    每次重播前後各校正一次，以較快的一次把這次的耗時換算成校正值為 reference_us 時的速度"""
+    per_verb = {}
+    before = calibrate(3)
+    for game in corpus:
+        runs = []
+        for _ in range(repeat):
+            timings = []
+            room = GameRoom('corpus', game['seed'])
+            room.shuffles = game['shuffles']
+            for c in game['commands']:
+                t0 = time.perf_counter_ns()
+                apply_command(room, Command(*c))
+                timings.append(time.perf_counter_ns() - t0)
+            after = calibrate(3)
+            scale = reference_us / min(before, after)
+            runs.append([t * scale for t in timings])
+            before = after
+        for i, c in enumerate(game['commands']):
+            per_verb.setdefault(c[0], []).append(min(run[i] for run in runs))
+    stats = {}
+    for verb, values in sorted(per_verb.items()):
+        values.sort()
+        pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] / 1000, 2)
+        stats[verb] = {'count': len(values), 'p50_us': pick(0.50), 'p99_us': pick(0.99)}
+    return stats
+
+
+def check(opts):
+    corpus = load_corpus(opts.corpus)
+    if not corpus: sys.exit(f"語料是空的：{opts.corpus} (先執行 generate 或 record)")
+
+    # 1. 行為：最終狀態必須與錄製時相同
+    mismatched = []
+    for game in corpus:
+        try: final = digest(replay(game))
+        except ValueError as e:
+            print(f"MISMATCH {e}")
+            mismatched.append(game['name'])
+            continue
+        if final != game['final']:
+            if opts.accept: game['final'] = final
+            else:
+                print(f"MISMATCH {game['name']}: final state {final[:12]} != recorded {game['final'][:12]}")
+                mismatched.append(game['name'])
+    if opts.accept:
+        save_corpus(opts.corpus, corpus)
+        print("final states accepted")
+
+    # 2. 效能：各動詞的 p50 與基準比較 (耗時已換算成基準的 CPU 速度；存基準時以這次開始時的校正值為準)
+    compared = not opts.save_baseline and os.path.exists(opts.baseline)
+    base = None
+    if compared:
+        with open(opts.baseline) as f: base = json.load(f)
+    reference = base['calibration_us'] if base else calibrate()
+    stats = measure(corpus, opts.repeat, reference)
+    result = {'python': platform.python_version(), 'calibration_us': reference, 'games': len(corpus), 'commands': sum(s['count'] for s in stats.values()), 'verbs': stats}
+    print(json.dumps(result, indent=2))
+    if opts.save_baseline:
+        with open(opts.baseline, 'w') as f: json.dump(result, f, indent=2)
+        print(f"baseline saved to {opts.baseline}")
+
+    regressed = []
+    if compared:
+        for verb, s in stats.items():
+            if verb not in base['verbs']: continue
+            expected = base['verbs'][verb]['p50_us']
+            p50 = s['p50_us']
+            if p50 > expected * (1 + opts.tolerance) and p50 - expected > MIN_DELTA_US:
+                print(f"REGRESSION {verb}: p50 {p50}us > baseline {expected}us + {opts.tolerance:.0%}")
+                regressed.append(verb)
+
+    if mismatched or regressed: sys.exit(1)
+    print(f"OK: {len(corpus)} games identical" + (f", all verbs within {opts.tolerance:.0%} of baseline" if compared else ""))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--corpus', default=os.path.join(CORPUS_DIR, 'games.jsonl'))
+    sub = ap.add_subparsers(dest='action', required=True)
+
+    g = sub.add_parser('generate', help='產生隨機合法對局')
+    g.add_argument('--games', type=int, default=12)
+    g.add_argument('--seed', type=int, default=1)
+    g.add_argument('--max-commands', type=int, default=2000, help='單局指令上限')
+
+    r = sub.add_parser('record', help='從日誌目錄擷取某一桌的對局')
+    r.add_argument('--journal', required=True)
+    r.add_argument('--room', required=True)
+
+    c = sub.add_parser('check', help='重播並與錄製結果及耗時基準比較')
+    c.add_argument('--baseline', default=os.path.join(CORPUS_DIR, 'baseline.json'))
+    c.add_argument('--save-baseline', action='store_true')
+    c.add_argument('--tolerance', type=float, default=0.25, help='p50 允許高於基準的比例')
+    c.add_argument('--repeat', type=int, default=5, help='每局重播次數 (每個指令取最快一次)')
+    c.add_argument('--accept', action='store_true', help='刻意改變行為後，以目前的最終狀態取代錄製值')
+    opts = ap.parse_args()
+
+    if opts.action == 'generate': add_games(opts.corpus, generate(opts.games, opts.seed, opts.max_commands))
+    elif opts.action == 'record': add_games(opts.corpus, record(opts.journal, opts.room))
+    else: check(opts)
+
+
+if __name__ == '__main__':
+    main()
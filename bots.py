@@ -0,0 +1,200 @@
+import json
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from game import GameRoom, N_CARDS
+from commands import PHASE_ACTOR, apply_command, legal_commands
+
+# 電腦玩家：每一步在行程池裡做蒙地卡羅搜尋 (不佔用 webhook 執行緒，也不受 GIL 限制)
+
+# 每個 gunicorn worker 的思考行程數 (每個 worker 各自一個池，第一次有電腦要出手時才建立)
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', 0)) or min(2, os.cpu_count() or 1)
+# 每一步的思考時間上限 (毫秒)
+BOT_MOVE_MS = int(os.environ.get('BOT_MOVE_MS', 500))
+# 排隊中的思考超過此數時改用快速走法 (不再送進行程池)
+BOT_MAX_PENDING = BOT_WORKERS * 4
+# 送出後多久 (毫秒) 還沒想好就改用快速走法並重建行程池 (子行程卡住時電腦的座位不會停住)；含排隊等待的時間
+BOT_TIMEOUT_MS = int(os.environ.get('BOT_TIMEOUT_MS', 0)) or max(5000, BOT_MOVE_MS * 10)
+# 每次模擬最多往後走幾步，走不到終局就以盤面評估
+ROLLOUT_DEPTH = 40
+# UCB1 的探索係數
+EXPLORATION = 1.2
+
+
+def bot_to_move(room):
+    """目前有操作權且由電腦操作的玩家 (沒有時回傳 None)"""
+    phase = room.state['phase']
+    if phase not in PHASE_ACTOR: return None
+    pid = PHASE_ACTOR[phase](room)
+    return pid if pid in room.state.get('bots', ()) else None
+
+
+def snapshot(room, version):
+    """輪到電腦時，回傳送進思考池的 (桌號, 版本, 玩家, 狀態 JSON)；須在該桌的鎖內呼叫 (當下就編碼，之後 room 會被修改)"""
+    pid = bot_to_move(room)
+    if pid is None: return None
+    return room.room_id, version, pid, json.dumps(room.to_dict())
+
+
+# --- 搜尋 (在子行程執行) ---
+
+def determinize(room, pid, rng):
+    """把電腦看不到的牌 (牌堆與其他玩家的手牌) 隨機重新分配，張數不變；並換掉洗牌種子"""
+    others = [p for p in room.players.values() if p.id != pid]
+    unseen = list(room.deck)
+    for p in others: unseen += [cid for cid in range(N_CARDS) for _ in range(p.hand[cid])]
+    rng.shuffle(unseen)
+    for p in others:
+        size = p.hand_size
+        p.hand = array('B', bytes(N_CARDS))
+        p.hand_size = 0
+        p.add_cards(unseen[:size])
+        del unseen[:size]
+    room.deck = bytearray(unseen)
+    room.seed = rng.getrandbits(63)
+    room.shuffles = 0
+
+
+def evaluate(room, team):
+    """以 team 的角度評估盤面 (0~1)：勝負已分時為 1/0，否則看星杯與寶石的差距 (星杯同時代表敵方士氣)"""
+    winner = room.state.get('winner')
+    if winner: return 1.0 if winner == team else 0.0
+    teams = room.state['teams']
+    mine, theirs = teams[team], teams['BLUE' if team == 'RED' else 'RED']
+    score = 3 * (mine['grails'] - theirs['grails']) + len(mine['gems']) - len(theirs['gems'])
+    return 1 / (1 + math.exp(-score / 4))
+
+
+def rollout(room, rng):
+    for _ in range(ROLLOUT_DEPTH):
+        if room.state['phase'] == 'FINISHED': return
+        cmds = legal_commands(room)
+        if not cmds: return
+        apply_command(room, rng.choice(cmds))
+
+
+def search(state_json, pid, budget, seed):
+    """在 budget 秒內對根節點的每個合法指令做 UCB1 + 隨機模擬，回傳 (最常被選的指令, 模擬次數)；
+    每次模擬前都檢查期限 (合法指令很多時不一定每個都試過)，一次都來不及模擬就用快速走法"""
+    deadline = time.perf_counter() + budget
+    rng = random.Random(seed)
+    data = json.loads(state_json)
+    team = data['players'][pid]['team']
+    moves = legal_commands(GameRoom.from_dict(data))
+    if len(moves) <= 1: return (moves[0] if moves else None), 0
+    visits = [0] * len(moves)
+    wins = [0.0] * len(moves)
+    n = 0
+    while time.perf_counter() < deadline:
+        if n < len(moves): i = n
+        else:
+            log_n = math.log(n)
+            i = max(range(len(moves)), key=lambda k: wins[k] / visits[k] + EXPLORATION * math.sqrt(log_n / visits[k]))
+        room = GameRoom.from_dict(json.loads(state_json))
+        determinize(room, pid, rng)
+        # 分配後這一步可能不合法 (例如要打的牌只是猜測)：直接算輸
+        if apply_command(room, moves[i]): rollout(room, rng)
+        else: room.state['winner'] = 'NONE'
+        visits[i] += 1
+        wins[i] += evaluate(room, team)
+        n += 1
+    if not n: return quick_move(state_json, pid), 0
+    best = max(range(len(moves)), key=lambda k: visits[k])
+    return moves[best], n
+
+
+def quick_move(state_json, pid):
+    """不搜尋的快速走法 (行程池忙碌或故障時使用)：能合成就合成，其次攻擊，否則第一個合法指令"""
+    moves = legal_commands(GameRoom.from_dict(json.loads(state_json)))
+    if not moves: return None
+    for verb in ('SYNTH', 'PLAY', 'COUNTER'):
+        for cmd in moves:
+            if cmd.verb == verb: return cmd
+    return moves[0]
+
+
+# --- 行程池 (在 web worker 執行) ---
+
+class BotPool:
+    """把思考工作送進行程池，想好後呼叫 on_move(桌號, 版本, 指令)；本身不等待結果"""
+
+    def __init__(self, workers=BOT_WORKERS, move_ms=BOT_MOVE_MS, timeout_ms=BOT_TIMEOUT_MS):
+        self.workers = workers
+        self.budget = move_ms / 1000
+        self.timeout = timeout_ms / 1000
+        self.executor = None
+        self.pid = None
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        # 行程池不能跨 fork 共用：每個 worker 行程在第一次用到時各自建立。
+        # 這時 worker 已有許多執行緒，直接 fork 可能繼承到被其他執行緒佔住的鎖：改由 forkserver (單執行緒) 產生子行程
+        with self.lock:
+            if self.pid != os.getpid():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['bots'])
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=context)
+                self.pid = os.getpid()
+            return self.executor
+
+    def think(self, request, on_move):
+        room_id, version, pid, state_json = request
+        with self.lock:
+            busy = self.pending >= BOT_MAX_PENDING
+            if not busy: self.pending += 1
+        if busy: return on_move(room_id, version, quick_move(state_json, pid), 'quick')
+        settled = []
+
+        def finish(cmd, source):
+            # 想好與逾時以先到者為準，只出手一次
+            with self.lock:
+                if settled: return
+                settled.append(source)
+                self.pending -= 1
+            on_move(room_id, version, cmd, source)
+
+        def done(future):
+            timer.cancel()
+            try: cmd, _ = future.result()
+            except Exception as e:
+                self._discard_if_broken(e)
+                return finish(quick_move(state_json, pid), 'quick')
+            finish(cmd, 'search')
+
+        def expire():
+            self._retire(executor)
+            finish(quick_move(state_json, pid), 'timeout')
+
+        try:
+            executor = self._executor()
+            future = executor.submit(search, state_json, pid, self.budget, random.getrandbits(63))
+        except Exception as e:
+            with self.lock: self.pending -= 1
+            self._discard_if_broken(e)
+            return on_move(room_id, version, quick_move(state_json, pid), 'quick')
+        timer = threading.Timer(self.timeout, expire)
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(done)
+
+    def _discard_if_broken(self, error):
+        # 子行程異常結束後池就不能再用：下次重建
+        if isinstance(error, BrokenProcessPool):
+            with self.lock: self.pid = None
+
+    def _retire(self, executor):
+        """逾時：子行程可能卡住了，換一個新的池 (舊池排隊中的工作會失敗而改用快速走法)"""
+        with self.lock:
+            if self.executor is not executor: return
+            self.pid = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        # 卡住的子行程不會自己結束
+        for process in list((getattr(executor, '_processes', None) or {}).values()): process.terminate()
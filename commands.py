@@ -0,0 +1,315 @@
+import re
+from collections import namedtuple
+
+from game import HAND_LIMIT, GEM_LIMIT, WIN_GRAIL_COUNT, CARD_DB_LIST, CARD_NAMES, CARD_INDEX, CARD_ELEMENTS, LIGHT, SHIELD, MISSILE, POISON, WEAK, check_counter_validity
+
+# 解析後的指令：verb 為動詞代號，actor/target 為玩家名稱，card 為卡牌編號
+Command = namedtuple('Command', 'verb actor card target')
+
+# --- 1. 指令解析 (一次比對完成) ---
+# 各分支外層的具名群組就是動詞；外層群組最後結束，所以 m.lastgroup 即為動詞
+COMMAND_RE = re.compile(r"""
+    (?:\[(?P<actor>[^\]]*)\]\s*)?
+    (?:
+        (?P<START>@測試開局)
+      | (?P<DRAW>@摸牌)
+      | (?P<SKIP>@跳過)
+      | (?P<BUY>購買)
+      | (?P<SYNTH>合成)
+      | (?P<EXTRACT>提煉)
+      | (?P<TAKE>承受)
+      | (?P<DISCARD>棄牌\s*\[(?P<discard_card>[^\]]+)\])
+      | (?P<PLAY>打出了\s*\[(?P<play_card>[^\]]+)\](?:\s*(?:攻擊|對)\s*(?P<play_target>\S.*?))?)
+      | (?P<COUNTER>應戰\s*\[(?P<counter_card>[^\]]+)\](?:\s*對\s*(?P<counter_target>\S.*?))?)
+      | (?P<BOT>@電腦\s*(?P<bot_target>\S.*?))
+    )\s*$
+""", re.VERBOSE)
+
+VERB_TEXT = {'START': '@測試開局', 'DRAW': '@摸牌', 'SKIP': '@跳過', 'BUY': '購買', 'SYNTH': '合成', 'EXTRACT': '提煉', 'TAKE': '承受'}
+CARD_GROUPS = {'DISCARD': 'discard_card', 'PLAY': 'play_card', 'COUNTER': 'counter_card'}
+TARGET_GROUPS = {'PLAY': 'play_target', 'COUNTER': 'counter_target', 'BOT': 'bot_target'}
+
+
+def parse_command(text):
+    """把聊天訊息轉成 Command；不是遊戲指令則回傳 None"""
+    m = COMMAND_RE.match(text.strip())
+    if not m: return None
+    verb = m.lastgroup
+    card = None
+    if verb in CARD_GROUPS:
+        card = CARD_INDEX.get(m.group(CARD_GROUPS[verb]))
+        if card is None: return None
+    target = m.group(TARGET_GROUPS[verb]) if verb in TARGET_GROUPS else None
+    return Command(verb, m.group('actor'), card, target)
+
+
+def format_command(cmd):
+    """Command -> 聊天室顯示的指令文字 (parse_command 的反向)"""
+    if cmd.verb == 'DISCARD': body = f"棄牌 [{CARD_NAMES[cmd.card]}]"
+    elif cmd.verb == 'PLAY':
+        body = f"打出了 [{CARD_NAMES[cmd.card]}]"
+        if cmd.target: body += f" {'攻擊' if CARD_DB_LIST[cmd.card]['type'] == 'attack' else '對'} {cmd.target}"
+    elif cmd.verb == 'COUNTER':
+        body = f"應戰 [{CARD_NAMES[cmd.card]}]" + (f" 對 {cmd.target}" if cmd.target else "")
+    elif cmd.verb == 'BOT': body = f"@電腦 {cmd.target}"
+    else: body = VERB_TEXT[cmd.verb]
+    return f"[{cmd.actor}] {body}" if cmd.actor else body
+
+
+# --- 2. 各階段的處理函數 handler(room, actor_id, cmd) ---
+# 以 room.emit 記錄事件；指令無效時直接 return、不產生事件也不改狀態
+
+def weak_draw(room, actor_id, cmd):
+    actor = room.players[actor_id]
+    actor.add_cards(room.draw_cards_from_deck(3)); actor.buffs['weak'] = False
+    room.state['phase'] = 'ACTION'
+    room.emit('WEAK_DRAW', player=actor_id)
+
+def weak_skip(room, actor_id, cmd):
+    actor = room.players[actor_id]
+    actor.buffs['weak'] = False
+    room.emit('WEAK_SKIP', player=actor_id)
+    room.next_turn()
+
+def draw(room, actor_id, cmd):
+    actor = room.players[actor_id]
+    if room.state['pending_draw_count'] <= 0: return
+    actor.add_cards(room.draw_cards_from_deck(1)); room.state['pending_draw_count'] -= 1
+    room.emit('CARD_DRAWN', player=actor_id, remaining=room.state['pending_draw_count'])
+    if room.state['pending_draw_count'] <= 0: room.check_discard_phase(actor_id)
+
+def discard(room, actor_id, cmd):
+    actor = room.players[actor_id]
+    if not actor.remove_card(cmd.card): return
+    room.discard_pile.append(cmd.card); room.state['pending_draw_count'] -= 1
+    room.emit('CARD_DISCARDED', player=actor_id, card=cmd.card, remaining=room.state['pending_draw_count'])
+    if room.state['pending_draw_count'] <= 0: room.proceed_after_clean()
+
+def buy(room, actor_id, cmd):
+    actor = room.players[actor_id]
+    team = room.state['teams'][actor.team]
+    if actor.hand_size + 3 > HAND_LIMIT:
+        return room.emit('REJECTED', reason='HAND_FULL', player=actor_id, hand_size=actor.hand_size)
+    if len(team['gems']) + 2 > GEM_LIMIT:
+        return room.emit('REJECTED', reason='GEMS_FULL', player=actor_id, gems=len(team['gems']))
+
+    actor.add_cards(room.draw_cards_from_deck(3))
+    room.add_gem(actor.team, 'red')
+    room.add_gem(actor.team, 'blue')
+    room.state['next_phase_after_clean'] = 'NEXT_TURN'
+    room.emit('BOUGHT', player=actor_id)
+    room.check_discard_phase(actor_id)
+
+def synth(room, actor_id, cmd):
+    actor = room.players[actor_id]
+    team = room.state['teams'][actor.team]
+    if actor.hand_size + 3 > HAND_LIMIT:
+        return room.emit('REJECTED', reason='HAND_FULL', player=actor_id, hand_size=actor.hand_size)
+    if len(team['gems']) < 3:
+        return room.emit('REJECTED', reason='GEMS_LOW', player=actor_id, gems=len(team['gems']))
+
+    del team['gems'][:3]; team['grails'] += 1
+    actor.add_cards(room.draw_cards_from_deck(3))
+    enemy = "BLUE" if actor.team=="RED" else "RED"
+    room.state['teams'][enemy]['morale'] -= 1
+
+    if team['grails'] >= WIN_GRAIL_COUNT or room.state['teams'][enemy]['morale'] <= 0:
+        room.finish(actor.team)
+        return room.emit('GAME_WON', player=actor_id, team=actor.team)
+
+    room.state['next_phase_after_clean'] = 'NEXT_TURN'
+    room.emit('SYNTHESIZED', player=actor_id)
+    room.check_discard_phase(actor_id)
+
+def extract(room, actor_id, cmd):
+    actor = room.players[actor_id]
+    team = room.state['teams'][actor.team]
+    if not team['gems']: return room.emit('REJECTED', reason='NO_GEMS', player=actor_id)
+    cnt = min(2, len(team['gems']))
+    for _ in range(cnt): actor.energy.append(team['gems'].pop(0))
+    room.emit('EXTRACTED', player=actor_id, count=cnt)
+    room.next_turn()
+
+def play_card(room, actor_id, cmd):
+    actor = room.players[actor_id]
+    card = cmd.card
+    if not actor.has_card(card): return
+    target_id = room.find_player_id(cmd.target) if cmd.target else None
+
+    if card == MISSILE:
+        actor.remove_card(card); room.discard_pile.append(card)
+        found = room.next_enemy_id(actor_id)
+        room.state['phase'] = 'RESOLVING_MISSILE'; room.state['missile_chain'] = {'damage': 2, 'target_id': found}
+        return room.emit('MISSILE_FIRED', player=actor_id, target=found, damage=2)
+
+    if card in (SHIELD, POISON, WEAK):
+        if not target_id: return
+        target = room.players[target_id]
+        if card == SHIELD and target.buffs['shield'] > 0: return
+        actor.remove_card(card); room.discard_pile.append(card)
+        if card == SHIELD: target.buffs['shield'] = 1
+        elif card == POISON: target.buffs['poison'] = True
+        elif card == WEAK: target.buffs['weak'] = True
+        room.emit('BUFF_APPLIED', player=actor_id, target=target_id, card=card)
+        return room.next_turn()
+
+    c_data = CARD_DB_LIST[card]
+    if c_data['type'] == 'attack':
+        if not target_id or actor.team == room.players[target_id].team: return
+        actor.remove_card(card); room.discard_pile.append(card)
+        room.state['phase'] = 'RESOLVING'
+        room.state['attack_chain'] = {
+            'damage': c_data['damage'], 'element': c_data['element'],
+            'card_name': c_data['name'], 'source_id': actor_id, 'source_name': actor.name, 'target_id': target_id
+        }
+        room.emit('ATTACKED', player=actor_id, target=target_id, card=card)
+
+def take_attack(room, actor_id, cmd):
+    chain = room.state['attack_chain']
+    target = room.players[actor_id]
+    if target.buffs['shield'] > 0:
+        target.buffs['shield'] = 0
+        room.emit('SHIELD_BLOCKED', player=actor_id)
+        return room.check_discard_phase(actor_id)
+
+    src_type = "attack" if chain['source_id'] == room.get_current_player_id() else "counter"
+    room.resolve_damage_init(actor_id, chain['damage'], source_type=src_type)
+
+def counter_attack(room, actor_id, cmd):
+    chain = room.state['attack_chain']
+    actor = room.players[actor_id]
+    resp_card = cmd.card
+    if not actor.has_card(resp_card): return
+    if resp_card == LIGHT:
+        actor.remove_card(resp_card); room.discard_pile.append(resp_card)
+        room.emit('LIGHT_BLOCKED', player=actor_id)
+        return room.check_discard_phase(actor_id)
+
+    if not cmd.target: return
+    valid, reason = check_counter_validity(chain['element'], resp_card)
+    if not valid: return
+    new_target_id = room.find_player_id(cmd.target)
+    if not new_target_id or new_target_id == chain['source_id']: return
+    actor.remove_card(resp_card); room.discard_pile.append(resp_card)
+    chain['source_id'] = actor_id; chain['source_name'] = actor.name; chain['target_id'] = new_target_id
+    if CARD_ELEMENTS[resp_card] == 'dark': chain['element'] = 'dark'
+    room.emit('ATTACK_REDIRECTED', player=actor_id, target=new_target_id, card=resp_card, element=chain['element'])
+
+def take_missile(room, actor_id, cmd):
+    chain = room.state['missile_chain']
+    room.resolve_damage_init(actor_id, chain['damage'], source_type="magic"); room.state['missile_chain'] = None
+
+def answer_missile(room, actor_id, cmd):
+    chain = room.state['missile_chain']
+    actor = room.players[actor_id]
+    card = cmd.card
+    if card not in (LIGHT, SHIELD, MISSILE) or not actor.remove_card(card): return
+    room.discard_pile.append(card)
+    if card in (LIGHT, SHIELD):
+        room.state['missile_chain'] = None
+        room.emit('MISSILE_BLOCKED', player=actor_id, card=card)
+        return room.check_discard_phase(actor_id)
+    found = room.next_enemy_id(actor_id)
+    chain['damage'] += 1; chain['target_id'] = found
+    room.emit('MISSILE_BOUNCED', player=actor_id, target=found, damage=chain['damage'])
+
+
+# --- 3. 派發表 ---
+# (階段, 動詞) -> 處理函數
+HANDLERS = {
+    ('CHOOSING_WEAKNESS', 'DRAW'): weak_draw,
+    ('CHOOSING_WEAKNESS', 'SKIP'): weak_skip,
+    ('DRAWING', 'DRAW'): draw,
+    ('DISCARDING', 'DISCARD'): discard,
+    ('ACTION', 'BUY'): buy,
+    ('ACTION', 'SYNTH'): synth,
+    ('ACTION', 'EXTRACT'): extract,
+    ('ACTION', 'PLAY'): play_card,
+    ('RESOLVING', 'TAKE'): take_attack,
+    ('RESOLVING', 'COUNTER'): counter_attack,
+    ('RESOLVING_MISSILE', 'TAKE'): take_missile,
+    ('RESOLVING_MISSILE', 'PLAY'): answer_missile,
+}
+
+# 各階段有操作權的玩家
+PHASE_ACTOR = {
+    'CHOOSING_WEAKNESS': lambda room: room.state['active_player_id'],
+    'DRAWING': lambda room: room.state['active_player_id'],
+    'DISCARDING': lambda room: room.state['active_player_id'],
+    'ACTION': lambda room: room.get_current_player_id(),
+    'RESOLVING': lambda room: room.state['attack_chain']['target_id'],
+    'RESOLVING_MISSILE': lambda room: room.state['missile_chain']['target_id'],
+}
+
+
+def apply_command(room, cmd):
+    """套用一個 Command，回傳事件清單 (None 代表指令無效、狀態未變)"""
+    room.events = []
+    room.command = cmd
+    if cmd.verb == 'START':
+        room.start_test_game()
+        return room.events
+    if cmd.verb == 'BOT':
+        # 任何階段都可切換 (對象為玩家名稱)
+        pid = room.find_player_id(cmd.target)
+        if not pid: return None
+        room.toggle_bot(pid)
+        return room.events
+
+    phase = room.state['phase']
+    handler = HANDLERS.get((phase, cmd.verb))
+    if handler is None: return None
+
+    # 未標示玩家時，視為目前被指定行動的玩家
+    actor_id = room.find_player_id(cmd.actor) if cmd.actor else None
+    if not actor_id: actor_id = room.state['active_player_id']
+    if not actor_id or actor_id != PHASE_ACTOR[phase](room): return None
+    handler(room, actor_id, cmd)
+    return room.events or None
+
+
+def is_rejection(events):
+    return bool(events) and events[-1]['type'] == 'REJECTED'
+
+
+# --- 4. 合法指令列舉 (基準測試與電腦玩家使用) ---
+
+def legal_commands(room):
+    """列出目前有操作權的玩家所有會被接受的指令"""
+    phase = room.state['phase']
+    if phase not in PHASE_ACTOR: return []
+    actor_id = PHASE_ACTOR[phase](room)
+    if not actor_id: return []
+    actor = room.players[actor_id]
+    name = actor.name
+    in_hand = [cid for cid in range(len(actor.hand)) if actor.hand[cid]]
+    enemies = [p for p in room.players.values() if p.team != actor.team]
+    cmds = []
+
+    if phase == 'CHOOSING_WEAKNESS':
+        cmds = [Command('DRAW', name, None, None), Command('SKIP', name, None, None)]
+    elif phase == 'DRAWING':
+        cmds = [Command('DRAW', name, None, None)]
+    elif phase == 'DISCARDING':
+        cmds = [Command('DISCARD', name, cid, None) for cid in in_hand]
+    elif phase == 'ACTION':
+        gems = len(room.state['teams'][actor.team]['gems'])
+        if actor.hand_size + 3 <= HAND_LIMIT and gems + 2 <= GEM_LIMIT: cmds.append(Command('BUY', name, None, None))
+        if actor.hand_size + 3 <= HAND_LIMIT and gems >= 3: cmds.append(Command('SYNTH', name, None, None))
+        if gems: cmds.append(Command('EXTRACT', name, None, None))
+        for cid in in_hand:
+            if cid == MISSILE: cmds.append(Command('PLAY', name, cid, None))
+            elif cid in (POISON, WEAK): cmds += [Command('PLAY', name, cid, p.name) for p in room.players.values()]
+            elif cid == SHIELD: cmds += [Command('PLAY', name, cid, p.name) for p in room.players.values() if not p.buffs['shield']]
+            elif CARD_DB_LIST[cid]['type'] == 'attack': cmds += [Command('PLAY', name, cid, p.name) for p in enemies]
+    elif phase == 'RESOLVING':
+        chain = room.state['attack_chain']
+        cmds.append(Command('TAKE', name, None, None))
+        for cid in in_hand:
+            if cid == LIGHT: cmds.append(Command('COUNTER', name, cid, None))
+            elif check_counter_validity(chain['element'], cid)[0]:
+                cmds += [Command('COUNTER', name, cid, p.name) for p in enemies if p.id != chain['source_id']]
+    elif phase == 'RESOLVING_MISSILE':
+        cmds.append(Command('TAKE', name, None, None))
+        cmds += [Command('PLAY', name, cid, None) for cid in in_hand if cid in (LIGHT, SHIELD, MISSILE)]
+    return cmds
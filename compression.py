@@ -0,0 +1,57 @@
+import gzip
+import hashlib
+import os
+
+# brotli 為選用套件：沒安裝時只提供 gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小於此位元組數不壓縮 (省下的比標頭與 CPU 還少)
+MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 512))
+# 動態回應 (每次請求都要壓) 用較低等級；預先壓縮的靜態內容用最高等級
+DYNAMIC_GZIP_LEVEL = 5
+DYNAMIC_BROTLI_QUALITY = 4
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+
+def available():
+    """伺服器支援的編碼 (偏好順序)"""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """依 Accept-Encoding (werkzeug 的 request.accept_encodings) 選編碼；都不接受時回傳 None"""
+    best, best_q = None, 0
+    for encoding in available():
+        q = accept_encodings[encoding]
+        if q > best_q: best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding, static=False):
+    if encoding == 'br': return brotli.compress(data, quality=STATIC_BROTLI_QUALITY if static else DYNAMIC_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=STATIC_GZIP_LEVEL if static else DYNAMIC_GZIP_LEVEL, mtime=0)
+
+
+class Precompressed:
+    """啟動時產生一次的內容：原文與各編碼版本都留在記憶體，ETag 取內容雜湊 (強 ETag，各編碼不同)"""
+
+    def __init__(self, text, mimetype):
+        self.mimetype = mimetype
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:20]
+        self.variants = {None: (data, digest)}
+        for encoding in available():
+            self.variants[encoding] = (compress(data, encoding, static=True), f"{digest}-{encoding}")
+
+    def select(self, accept_encodings):
+        """(編碼, 內容, ETag)"""
+        encoding = negotiate(accept_encodings)
+        data, etag = self.variants[encoding]
+        return encoding, data, etag
+
+    def etags(self):
+        return [etag for _, etag in self.variants.values()]
@@ -0,0 +1,62 @@
+import os
+import queue
+import threading
+import traceback
+import zlib
+
+
+class Dispatcher:
+    """依桌號分片的工作佇列：同一桌的事件依序執行，不同桌平行執行"""
+
+    def __init__(self, workers=None):
+        self.size = workers or int(os.environ.get('WEBHOOK_WORKERS', 8))
+        self.queues = [queue.Queue() for _ in range(self.size)]
+        self.pid = None
+        self.guard = threading.Lock()
+        # 每個 key 排隊中的工作數 (限制單一桌能佔用的佇列長度)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def _ensure_started(self):
+        # 執行緒不會跨 fork 存活：每個 worker 行程第一次使用時才啟動
+        if self.pid == os.getpid(): return
+        with self.guard:
+            if self.pid == os.getpid(): return
+            for q in self.queues:
+                threading.Thread(target=self._run, args=(q,), daemon=True).start()
+            self.pid = os.getpid()
+
+    def start(self):
+        """預先啟動執行緒 (worker 預熱時呼叫)"""
+        self._ensure_started()
+
+    def submit(self, key, job, *args, limit=None):
+        """同一個 key 永遠落在同一條執行緒，保證先進先出。
+        limit：該 key 最多排幾個工作，超過則丟棄並回傳 False"""
+        self._ensure_started()
+        with self.lock:
+            count = self.pending.get(key, 0)
+            if limit is not None and count >= limit: return False
+            self.pending[key] = count + 1
+        self.queues[zlib.crc32(key.encode('utf-8')) % self.size].put((key, job, args))
+        return True
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _run(self, q):
+        while True:
+            key, job, args = q.get()
+            try:
+                job(*args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self.lock:
+                    self.pending[key] -= 1
+                    if not self.pending[key]: del self.pending[key]
+                q.task_done()
+
+    def join(self):
+        """等待所有已排入的事件處理完畢 (測試與關機用)"""
+        for q in self.queues: q.join()
@@ -0,0 +1,345 @@
+import random
+from array import array
+
+# --- 遊戲常數 ---
+HAND_LIMIT = 6
+GEM_LIMIT = 5
+WIN_GRAIL_COUNT = 5
+
+# --- 卡牌資料庫 ---
+CARD_DB_LIST = (
+    {"id": "atk_fire", "name": "火攻擊", "type": "attack", "element": "fire", "damage": 2, "count": 10},
+    {"id": "atk_water", "name": "水攻擊", "type": "attack", "element": "water", "damage": 2, "count": 10},
+    {"id": "atk_wind", "name": "風攻擊", "type": "attack", "element": "wind", "damage": 2, "count": 10},
+    {"id": "atk_earth", "name": "地攻擊", "type": "attack", "element": "earth", "damage": 2, "count": 10},
+    {"id": "atk_thunder", "name": "雷攻擊", "type": "attack", "element": "thunder", "damage": 2, "count": 10},
+    {"id": "atk_dark", "name": "暗黑攻擊", "type": "attack", "element": "dark", "damage": 2, "count": 5},
+    {"id": "def_light", "name": "聖光", "type": "magic", "element": "light", "damage": 0, "count": 5},
+    {"id": "sup_shield", "name": "聖盾", "type": "magic", "element": "light", "damage": 0, "count": 5},
+    {"id": "mgc_missile", "name": "魔彈", "type": "magic", "element": "none", "damage": 2, "count": 5},
+    {"id": "mgc_poison", "name": "中毒", "type": "magic", "element": "none", "damage": 0, "count": 3},
+    {"id": "mgc_weak", "name": "虛弱", "type": "magic", "element": "none", "damage": 0, "count": 3}
+)
+CARD_MAP = { c['name']: c for c in CARD_DB_LIST }
+
+# 整數卡牌編號 = 在 CARD_DB_LIST 中的位置；牌堆、棄牌堆與手牌都只存編號
+CARD_NAMES = tuple(c['name'] for c in CARD_DB_LIST)
+CARD_INDEX = { name: i for i, name in enumerate(CARD_NAMES) }
+CARD_ELEMENTS = tuple(c['element'] for c in CARD_DB_LIST)
+N_CARDS = len(CARD_DB_LIST)
+FULL_DECK = bytes(i for i, c in enumerate(CARD_DB_LIST) for _ in range(c.get('count', 1)))
+
+LIGHT = CARD_INDEX['聖光']
+SHIELD = CARD_INDEX['聖盾']
+MISSILE = CARD_INDEX['魔彈']
+POISON = CARD_INDEX['中毒']
+WEAK = CARD_INDEX['虛弱']
+
+TEST_ROLES = ({'id': 'red1', 'name': '紅1', 'team': 'RED'}, {'id': 'red2', 'name': '紅2', 'team': 'RED'}, {'id': 'blue1', 'name': '藍1', 'team': 'BLUE'}, {'id': 'blue2', 'name': '藍2', 'team': 'BLUE'})
+
+
+def new_teams():
+    return {'RED': {'morale': 15, 'gems': [], 'grails': 0}, 'BLUE': {'morale': 15, 'gems': [], 'grails': 0}}
+
+
+def new_game_state():
+    return {
+        'turn_order': [],
+        'current_turn_idx': 0,
+        'phase': 'WAITING',
+        'attack_chain': None,
+        'missile_chain': None,
+        'active_player_id': None,
+        'pending_draw_count': 0,
+        'next_phase_after_clean': 'NEXT_TURN',
+        'winner': None,
+        'teams': new_teams(),
+        # 由電腦操作的玩家 ID
+        'bots': []
+    }
+
+
+def check_counter_validity(attack_elem, respond_card_id):
+    if respond_card_id is None or not 0 <= respond_card_id < N_CARDS: return False, "卡牌錯誤"
+    resp_elem = CARD_ELEMENTS[respond_card_id]
+
+    if respond_card_id == LIGHT: return True, "聖光"
+    if attack_elem == 'dark': return False, "暗屬性攻擊無法應戰"
+    if attack_elem == resp_elem: return True, "同屬性應戰"
+    if resp_elem == 'dark': return True, "暗屬性應戰"
+    return False, f"屬性不符 ({attack_elem} vs {resp_elem})"
+
+
+class Player:
+    """玩家 (手牌以各卡牌編號的張數向量儲存，查詢/移除都是 O(1))"""
+    __slots__ = ('id', 'name', 'team', 'hand', 'hand_size', 'buffs', 'heal_points', 'energy')
+
+    def __init__(self, pid, name, team):
+        self.id = pid
+        self.name = name
+        self.team = team
+        self.hand = array('B', bytes(N_CARDS))
+        self.hand_size = 0
+        self.buffs = {'shield': 0, 'poison': False, 'weak': False}
+        self.heal_points = 0
+        self.energy = []
+
+    def has_card(self, card_id):
+        return self.hand[card_id] > 0
+
+    def add_cards(self, card_ids):
+        for cid in card_ids: self.hand[cid] += 1
+        self.hand_size += len(card_ids)
+
+    def remove_card(self, card_id):
+        if not self.hand[card_id]: return False
+        self.hand[card_id] -= 1
+        self.hand_size -= 1
+        return True
+
+    def hand_names(self):
+        """依卡牌編號排序展開成卡名清單 (給前端顯示)"""
+        return [CARD_NAMES[cid] for cid in range(N_CARDS) for _ in range(self.hand[cid])]
+
+    def to_view(self):
+        """前端使用的格式 (手牌為卡名清單)"""
+        return {'name': self.name, 'team': self.team, 'hand': self.hand_names(), 'buffs': self.buffs, 'heal_points': self.heal_points, 'energy': self.energy}
+
+    def to_dict(self):
+        return {'name': self.name, 'team': self.team, 'hand': self.hand.tolist(), 'buffs': self.buffs, 'heal_points': self.heal_points, 'energy': self.energy}
+
+    @classmethod
+    def from_dict(cls, pid, data):
+        p = cls(pid, data['name'], data['team'])
+        p.hand = array('B', data['hand'])
+        p.hand_size = sum(p.hand)
+        p.buffs = data['buffs']
+        p.heal_points = data['heal_points']
+        p.energy = data['energy']
+        return p
+
+
+class GameRoom:
+    """一桌遊戲 (擁有自己的牌堆、棄牌堆、玩家與階段)"""
+
+    def __init__(self, room_id, seed=None):
+        self.room_id = room_id
+        # 本桌亂數種子與已洗牌次數：同樣的指令序列必定得到同樣的牌局 (供日誌重播)
+        self.seed = random.getrandbits(63) if seed is None else seed
+        self.shuffles = 0
+        self.players = {}
+        # 玩家名稱 -> ID 的索引
+        self.name_index = {}
+        self.deck = bytearray()
+        self.discard_pile = bytearray()
+        self.state = new_game_state()
+        # 本次指令產生的事件 (不儲存)
+        self.events = []
+        # 本次套用的指令 (不儲存，供日誌記錄)
+        self.command = None
+        # 每次狀態變更 +1 (由 store 在寫入時遞增)，供推播與 ETag 使用
+        self.version = 0
+
+    def to_dict(self):
+        return {
+            'room_id': self.room_id, 'version': self.version, 'seed': self.seed, 'shuffles': self.shuffles,
+            'players': {pid: p.to_dict() for pid, p in self.players.items()},
+            'deck': list(self.deck), 'discard_pile': list(self.discard_pile), 'state': self.state
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        room = cls(data['room_id'], data.get('seed'))
+        room.version = data.get('version', 0)
+        room.shuffles = data.get('shuffles', 0)
+        room.players = {pid: Player.from_dict(pid, p) for pid, p in data['players'].items()}
+        room.name_index = {p.name: pid for pid, p in room.players.items()}
+        room.deck = bytearray(data['deck'])
+        room.discard_pile = bytearray(data['discard_pile'])
+        room.state = data['state']
+        return room
+
+    # --- 輔助函數 ---
+
+    def emit(self, kind, **data):
+        """記錄一個結構化事件 (由 messages.render_events 轉成聊天文字)"""
+        data['type'] = kind
+        self.events.append(data)
+
+    def shuffle(self, items):
+        """以 (種子, 洗牌次數) 決定的亂數洗牌"""
+        random.Random(self.seed ^ (self.shuffles * 0x9E3779B97F4A7C15)).shuffle(items)
+        self.shuffles += 1
+
+    def init_deck(self):
+        """初始化牌堆"""
+        self.deck = bytearray(FULL_DECK)
+        self.shuffle(self.deck)
+        self.discard_pile = bytearray()
+        self.emit('DECK_INIT', size=len(self.deck))
+
+    def draw_cards_from_deck(self, count):
+        """抽牌 (含自動洗牌與強制補牌機制)"""
+        drawn = []
+
+        # 保險機制：如果牌堆和棄牌堆都空了，重新生成一副新牌
+        if not self.deck and not self.discard_pile:
+            self.init_deck()
+
+        for _ in range(count):
+            if not self.deck:
+                if self.discard_pile:
+                    self.deck = self.discard_pile
+                    self.shuffle(self.deck)
+                    self.discard_pile = bytearray()
+                    self.emit('RESHUFFLE', size=len(self.deck))
+                else:
+                    # 真的沒牌了 (極端情況)
+                    break
+
+            if self.deck:
+                drawn.append(self.deck.pop())
+
+        return drawn
+
+    def get_current_player_id(self):
+        if not self.state['turn_order']: return None
+        return self.state['turn_order'][self.state['current_turn_idx']]
+
+    def find_player_id(self, name):
+        return self.name_index.get(name)
+
+    def add_gem(self, team_name, color):
+        """增加寶石 (不超過上限)"""
+        team = self.state['teams'][team_name]
+        if len(team['gems']) < GEM_LIMIT:
+            team['gems'].append(color)
+            return True
+        return False
+
+    def start_test_game(self):
+        """@測試開局：重置並以固定四人測試陣容開局"""
+        self.init_deck()
+        self.players.clear()
+        self.name_index.clear()
+        # 電腦座位保留到下一局
+        bots = self.state.get('bots', [])
+        self.state = new_game_state()
+        self.state['bots'] = bots
+        roles = [dict(r) for r in TEST_ROLES]
+        self.shuffle(roles)
+        self.state['turn_order'] = [r['id'] for r in roles]
+        self.state['phase'] = 'ACTION'
+        for r in roles:
+            # ★ 關鍵：若 draw_cards 失敗會觸發 init_deck 重試
+            p = self.players[r['id']] = Player(r['id'], r['name'], r['team'])
+            p.add_cards(self.draw_cards_from_deck(4))
+            self.name_index[r['name']] = r['id']
+        self.emit('GAME_STARTED', order=self.state['turn_order'])
+
+    def toggle_bot(self, player_id):
+        """@電腦：切換該玩家由電腦或真人操作"""
+        bots = self.state.setdefault('bots', [])
+        if player_id in bots: bots.remove(player_id)
+        else: bots.append(player_id)
+        self.emit('BOT_SEAT', player=player_id, on=player_id in bots)
+
+    def finish(self, team):
+        """分出勝負：停在 FINISHED，直到下一次開局"""
+        self.state['phase'] = 'FINISHED'
+        self.state['active_player_id'] = None
+        self.state['winner'] = team
+
+    # --- 流程控制 ---
+
+    def prepare_draw_phase(self, player_id, count):
+        """進入摸牌階段"""
+        if count <= 0: return self.check_discard_phase(player_id)
+
+        self.state['phase'] = 'DRAWING'
+        self.state['active_player_id'] = player_id
+        self.state['pending_draw_count'] = count
+        self.emit('DRAW_REQUIRED', player=player_id, count=count)
+
+    def check_discard_phase(self, player_id):
+        """檢查棄牌"""
+        p = self.players[player_id]
+        excess = p.hand_size - HAND_LIMIT
+        if excess > 0:
+            self.state['phase'] = 'DISCARDING'
+            self.state['active_player_id'] = player_id
+            self.state['pending_draw_count'] = excess
+            self.emit('DISCARD_REQUIRED', player=player_id, hand_size=p.hand_size, count=excess)
+        else:
+            self.proceed_after_clean()
+
+    def proceed_after_clean(self):
+        """手牌整理後的流向"""
+        next_step = self.state['next_phase_after_clean']
+
+        if next_step == 'ACTION':
+            # 回到該玩家的回合
+            self.state['phase'] = 'ACTION'
+            self.state['active_player_id'] = None
+            self.state['next_phase_after_clean'] = 'NEXT_TURN' # 重置
+            self.emit('ACTION_RESUMED', player=self.get_current_player_id())
+        else:
+            self.next_turn()
+
+    def resolve_damage_init(self, target_id, damage_amount, source_type="attack", next_phase='NEXT_TURN'):
+        """結算傷害 -> 產石 -> 進入摸牌"""
+        self.state['next_phase_after_clean'] = next_phase
+        player = self.players.get(target_id)
+        heal = player.heal_points
+        actual_heal = min(damage_amount, heal)
+        final_damage = damage_amount - actual_heal
+        if actual_heal > 0: player.heal_points -= actual_heal
+
+        self.emit('DAMAGE', player=target_id, damage=damage_amount, healed=actual_heal, final=final_damage)
+
+        if final_damage > 0:
+            attacker_team = "RED" if player.team == "BLUE" else "BLUE"
+            gem_color = "red" if source_type == "attack" else "blue"
+            if self.add_gem(attacker_team, gem_color):
+                self.emit('GEM', team=attacker_team, color=gem_color)
+
+        self.prepare_draw_phase(target_id, final_damage)
+
+    def next_turn(self):
+        """回合切換"""
+        total = len(self.state['turn_order'])
+        self.state['current_turn_idx'] = (self.state['current_turn_idx'] + 1) % total
+        self.state['attack_chain'] = None
+        self.state['missile_chain'] = None
+        self.state['phase'] = 'ACTION'
+        self.state['active_player_id'] = None
+        self.state['next_phase_after_clean'] = 'NEXT_TURN'
+
+        pid = self.get_current_player_id()
+        p = self.players[pid]
+
+        # 虛弱
+        if p.buffs['weak']:
+            self.state['phase'] = 'CHOOSING_WEAKNESS'
+            self.state['active_player_id'] = pid
+            self.emit('WEAK_TURN', player=pid)
+            return
+
+        # 中毒
+        if p.buffs['poison']:
+            self.emit('POISONED', player=pid)
+            self.resolve_damage_init(pid, 1, source_type="magic", next_phase='ACTION')
+            return
+
+        self.emit('TURN_START', player=pid)
+
+    def next_enemy_id(self, actor_id):
+        """魔彈：沿座位順序找下一位敵方玩家"""
+        actor = self.players[actor_id]
+        order = self.state['turn_order']
+        total = len(order); curr = order.index(actor_id)
+        for i in range(1, total):
+            pid = order[(curr+i)%total]
+            if self.players[pid].team != actor.team: return pid
+        return None
+
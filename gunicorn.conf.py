@@ -0,0 +1,34 @@
+import gc
+import os
+
+# gunicorn -c gunicorn.conf.py app:app
+
+# Render 等平台以 PORT 指定埠號
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# 記憶體儲存只能單一 worker；多 worker 請設 GAME_STORE=sqlite 或 redis
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+# SSE 連線最長 25 秒 (app.STREAM_LIFETIME)，且每個 worker 最多佔 threads/4 條 (app.STREAM_MAX_OPEN)
+timeout = 45
+keepalive = 5
+# master 只載入一次應用程式，fork 出的 worker 以 copy-on-write 共用唯讀的模組、卡牌表與已編譯的模板；
+# 牌局狀態不在 master 載入 (記憶體儲存在每個 worker 第一次使用時才從日誌/休眠檔還原，重生的 worker 也是)
+preload_app = True
+
+# 載入期間先停用 GC，fork 前再把載入的物件全部凍結
+gc.disable()
+
+
+def when_ready(server):
+    """master 載入完成 (fork 前)：編譯模板，並把目前所有物件移出 GC 追蹤，避免 GC 掃描時寫入共用頁面"""
+    import app
+    app.prepare()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """worker 啟動：恢復 GC，還原牌局、啟動佇列執行緒 (LINE 連線在背景建立)"""
+    gc.enable()
+    import app
+    app.warm_worker()
@@ -0,0 +1,183 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+from game import GameRoom
+from commands import Command, apply_command, format_command
+from messages import render_events
+
+# 批次 fsync 的間隔 (毫秒)：當機時最多遺失這段時間內的指令
+FSYNC_INTERVAL_MS = int(os.environ.get('JOURNAL_FSYNC_MS', 50))
+# 上次快照後累積多少筆就再做一次快照並截斷日誌 (重啟時最多重播這麼多筆)
+SNAPSHOT_EVERY = int(os.environ.get('JOURNAL_SNAPSHOT_EVERY', 5000))
+
+# 目錄內容：
+#   log.<seq>.jsonl       指令日誌，一行一筆 {"r": 房間, "v": 套用後版本, "c": [verb, actor, card, target], "s": 種子 (僅 v=1)}
+#   snapshot.<seq>.jsonl  換到 log.<seq> 之後寫出的所有牌局 (一行一桌)；還原 = 最新快照 + log.<seq> 起的日誌
+
+
+def read_entries(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try: yield json.loads(line)
+            except ValueError: return  # 當機時寫到一半的最後一行
+
+
+def replay_entry(rooms, entry, load=None):
+    """把一筆日誌套用到 rooms，回傳 (room, events)；已包含在快照內的舊紀錄回傳 (room, None)
+    快照裡沒有的牌局先以 load(room_id) 取得 (例如已休眠到磁碟的)，再不然才從頭開始；
+    找不到基準 (休眠檔已過期刪除) 又不是第一筆的牌局略過，回傳 (None, None)"""
+    room = rooms.get(entry['r'])
+    if room is None:
+        room = load(entry['r']) if load else None
+        if room is None:
+            if entry['v'] != 1: return None, None
+            room = GameRoom(entry['r'], entry.get('s'))
+        rooms[entry['r']] = room
+    if entry['v'] <= room.version: return room, None
+    events = apply_command(room, Command(*entry['c']))
+    room.version = entry['v']
+    return room, events
+
+
+class Journal:
+    """指令日誌 + 定期快照：讓記憶體中的牌局在 worker 重啟後還原"""
+
+    def __init__(self, path, fsync_ms=FSYNC_INTERVAL_MS, snapshot_every=SNAPSHOT_EVERY):
+        self.path = path
+        self.fsync_interval = fsync_ms / 1000
+        self.snapshot_every = snapshot_every
+        self.lock = threading.Lock()
+        self.file = None
+        self.seq = 0
+        # 上次快照後的筆數 (含還原時重播的部分)
+        self.count = 0
+        self.dirty = False
+        self.dump_rooms = None
+        self.pid = None
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, kind, seq):
+        return os.path.join(self.path, f"{kind}.{seq:08d}.jsonl")
+
+    def _list(self, kind):
+        out = []
+        for name in os.listdir(self.path):
+            parts = name.split('.')
+            if len(parts) == 3 and parts[0] == kind and parts[2] == 'jsonl': out.append(int(parts[1]))
+        return sorted(out)
+
+    def _open(self):
+        self.file = open(self._file('log', self.seq), 'a', encoding='utf-8')
+
+    def recover(self, load=None):
+        """讀取最新快照並重播之後的日誌，回傳 {room_id: GameRoom}"""
+        rooms = {}
+        snapshots = self._list('snapshot')
+        start = snapshots[-1] if snapshots else 0
+        if snapshots:
+            with open(self._file('snapshot', start), encoding='utf-8') as f:
+                for line in f:
+                    room = GameRoom.from_dict(json.loads(line))
+                    rooms[room.room_id] = room
+
+        logs = [seq for seq in self._list('log') if seq >= start]
+        for seq in logs:
+            for entry in read_entries(self._file('log', seq)):
+                self.count += 1
+                replay_entry(rooms, entry, load)
+
+        # 從新的檔案接著寫 (舊檔最後一行可能是半行)
+        self.seq = max([start] + logs) + 1
+        self._open()
+        return rooms
+
+    def attach(self, dump_rooms):
+        """dump_rooms() 逐桌產生序列化後的牌局 (由 store 在各桌的鎖內產生)"""
+        self.dump_rooms = dump_rooms
+
+    def append(self, room, cmd):
+        """記錄一筆已套用的指令 (在該桌的鎖內呼叫，寫入緩衝區後立即返回)"""
+        if self.pid != os.getpid(): self._start()
+        entry = {'r': room.room_id, 'v': room.version, 'c': list(cmd)}
+        if room.version == 1: entry['s'] = room.seed
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.count += 1
+            self.dirty = True
+
+    def _start(self):
+        """每個行程各自啟動背景 fsync 執行緒 (fork 後執行緒不會被繼承)"""
+        with self.lock:
+            if self.pid == os.getpid(): return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.sync)
+
+    def _run(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            self.sync()
+            if self.dump_rooms and self.count >= self.snapshot_every: self.compact()
+
+    def sync(self):
+        """把緩衝區寫入並 fsync (批次：一次涵蓋這段時間內的所有指令)"""
+        with self.lock:
+            if not self.dirty: return
+            self.file.flush()
+            self.dirty = False
+            fd = self.file.fileno()
+        os.fsync(fd)
+
+    def compact(self):
+        """換新的日誌檔，寫出所有牌局的快照，再刪除舊日誌與舊快照"""
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.seq += 1
+            self.count = 0
+            self.dirty = False
+            self._open()
+        seq = self.seq
+
+        # 換檔後才讀各桌狀態：快照一定包含舊日誌的所有紀錄，新日誌中已在快照內的紀錄以版本號略過
+        tmp = self._file('snapshot', seq) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for data in self.dump_rooms(): f.write(data + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file('snapshot', seq))
+
+        for kind in ('log', 'snapshot'):
+            for old in self._list(kind):
+                if old < seq: os.remove(self._file(kind, old))
+
+
+def replay(path, room_id):
+    """從最新快照重播某一桌的日誌，逐筆印出指令與回覆 (除錯用)"""
+    journal = Journal(path)
+    rooms = {}
+    snapshots = journal._list('snapshot')
+    start = snapshots[-1] if snapshots else 0
+    if snapshots:
+        for entry in read_entries(journal._file('snapshot', start)):
+            if entry['room_id'] == room_id: rooms[room_id] = GameRoom.from_dict(entry)
+    for seq in journal._list('log'):
+        if seq < start: continue
+        for entry in read_entries(journal._file('log', seq)):
+            if entry['r'] != room_id: continue
+            room, events = replay_entry(rooms, entry)
+            if events is None: continue
+            print(f"[v{room.version}] {format_command(Command(*entry['c']))}")
+            print(render_events(room, events) or '')
+            print()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3: sys.exit("用法: python journal.py <日誌目錄> <room_id>")
+    replay(sys.argv[1], sys.argv[2])
@@ -0,0 +1,207 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from dispatcher import Dispatcher
+from metrics import Counter, Histogram
+
+# LINE Messaging API 位址 (離線測試時指向 tools/line_stub.py)
+LINE_API_URL = os.environ.get('LINE_API_URL', 'https://api.line.me')
+# 連線池大小 (keep-alive 連線數) 與送出執行緒數 (回覆與推播共用，依對象分片)
+POOL_SIZE = int(os.environ.get('LINE_POOL_SIZE', 16))
+PUSH_WORKERS = int(os.environ.get('LINE_PUSH_WORKERS', 8))
+# 一次回覆/推播最多 5 則訊息；每則文字最多 5000 字
+MAX_MESSAGES = 5
+MAX_TEXT = 5000
+# (連線, 讀取) 逾時秒數
+TIMEOUT = (3.05, 10)
+# 429/5xx/連線錯誤最多嘗試幾次，退避基準秒數，Retry-After 最多等幾秒
+MAX_ATTEMPTS = 3
+RETRY_BASE = 0.2
+RETRY_AFTER_CAP = 5
+# 斷路器：連續失敗幾次就開路，開路幾秒後放一個請求試探
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 10
+
+LINE_SECONDS = Histogram('stargrail_line_api_seconds', 'LINE API 每次請求嘗試的耗時', ['endpoint'])
+LINE_ERRORS = Counter('stargrail_line_api_errors_total', 'LINE API 失敗次數 (status=0 為連線錯誤/逾時，circuit_open 為斷路器擋下)', ['endpoint', 'status'])
+
+
+class LineApiError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"LINE API {status_code}: {message}")
+        self.status_code = status_code
+
+
+class CircuitOpenError(LineApiError):
+    def __init__(self):
+        super().__init__(503, "斷路器開啟中，暫停送出")
+
+
+class CircuitBreaker:
+    """連續失敗達門檻就開路 (期間直接失敗，不再佔住執行緒等 LINE)；冷卻後只放一個請求試探"""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def state(self):
+        if self.opened_at is None: return 'closed'
+        return 'half-open' if self.probing or time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None: return True
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown: return False
+            self.probing = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold: self.opened_at = time.monotonic()
+            self.probing = False
+
+
+def text_messages(texts):
+    """文字 -> LINE 文字訊息 (超過長度上限的切成多則)"""
+    out = []
+    for text in texts:
+        for i in range(0, max(len(text), 1), MAX_TEXT):
+            out.append({'type': 'text', 'text': text[i:i + MAX_TEXT]})
+    return out
+
+
+def retry_delay(attempt, retry_after=None):
+    if retry_after and retry_after.isdigit(): return min(int(retry_after), RETRY_AFTER_CAP)
+    return RETRY_BASE * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+class LineClient:
+    """送出 LINE 訊息：keep-alive 連線池、逾時、有限次重試、斷路器，推播依對象合併"""
+
+    def __init__(self, token, base_url=LINE_API_URL, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Authorization': f"Bearer {token}", 'Content-Type': 'application/json'})
+        self.breaker = CircuitBreaker()
+        # 尚未送出的推播：對象 -> 訊息清單 (同一對象的多次推播合併送出；每批有自己的送出工作)
+        self.outbox = {}
+        self.lock = threading.Lock()
+        # 同一對象的回覆與推播依序送出 (沿用 webhook 的分片佇列)
+        self.sender = Dispatcher(PUSH_WORKERS)
+
+    def post(self, path, body, retry_key=None):
+        """送出一個 API 請求 (429/5xx/連線錯誤會退避重試；其他 4xx 直接拋出)"""
+        endpoint = path.rsplit('/', 1)[-1]
+        if not self.breaker.allow():
+            LINE_ERRORS.inc(endpoint, 'circuit_open')
+            raise CircuitOpenError()
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        # 推播帶 retry key：重試時 LINE 不會重複送出 (已受理會回 409)
+        headers = {'X-Line-Retry-Key': retry_key} if retry_key else None
+        status, message = 0, ''
+        for attempt in range(MAX_ATTEMPTS):
+            retry_after = None
+            t0 = time.perf_counter()
+            try:
+                resp = self.session.post(self.base_url + path, data=data, headers=headers, timeout=TIMEOUT)
+                status, message = resp.status_code, resp.text
+                retry_after = resp.headers.get('Retry-After')
+            except requests.RequestException as e:
+                status, message = 0, str(e)
+            LINE_SECONDS.observe(time.perf_counter() - t0, endpoint)
+
+            if status and (status < 300 or (status == 409 and retry_key)):
+                self.breaker.success()
+                return
+            LINE_ERRORS.inc(endpoint, str(status))
+            if status and status != 429 and status < 500:
+                # 請求本身有誤 (例如 reply token 失效)，不算 LINE 異常
+                self.breaker.success()
+                raise LineApiError(status, message)
+            if attempt + 1 < MAX_ATTEMPTS: time.sleep(retry_delay(attempt, retry_after))
+        self.breaker.failure()
+        raise LineApiError(status, message)
+
+    def warm(self):
+        """預先建立 keep-alive 連線並啟動推播執行緒 (fork 後在 worker 內呼叫)；回傳是否連得上"""
+        self.sender.start()
+        try: self.session.get(self.base_url + '/v2/bot/info', timeout=TIMEOUT)
+        except requests.RequestException: return False
+        return True
+
+    def reply(self, reply_token, to, texts, deadline=None):
+        """排入該對象的送出佇列後立即返回 (呼叫端不等 LINE)；deadline 為 reply token 的到期時間 (time.time())"""
+        with self.lock:
+            # 之前的推播批次到此為止 (由已排在前面的工作送出)，之後的推播另起一批、排在回覆之後
+            self.outbox.pop(to, None)
+            self.sender.submit(to, self._reply, reply_token, to, text_messages(texts), deadline)
+
+    def _reply(self, reply_token, to, messages, deadline):
+        """用 reply token 回覆 (接著帶出回覆之後才排入、還沒送出的推播)；token 已過期、超過 5 則或回覆失敗的部分改用推播"""
+        with self.lock:
+            later = self.outbox.pop(to, None)
+            if later:
+                messages = messages + later
+                # 該批的送出工作之後執行時就沒有東西可送
+                later.clear()
+        if deadline is None or time.time() < deadline:
+            try:
+                self.post('/v2/bot/message/reply', {'replyToken': reply_token, 'messages': messages[:MAX_MESSAGES]})
+                messages = messages[MAX_MESSAGES:]
+            except LineApiError:
+                # token 失效/逾時，或 LINE 暫時異常：整批改走推播
+                pass
+        # 已在該對象的送出執行緒上：直接推播，排在之後的推播前面
+        if messages: self._push_now(to, messages)
+
+    def push(self, to, texts):
+        """排入推播佇列後立即返回"""
+        self._enqueue(to, text_messages(texts))
+
+    def _enqueue(self, to, messages):
+        with self.lock:
+            pending = self.outbox.get(to)
+            if pending is not None:
+                # 前一批還沒送出：直接併入，不另外排工作
+                pending.extend(messages)
+                return
+            batch = self.outbox[to] = list(messages)
+            # 在鎖內排入：送出佇列的順序與批次建立的順序相同
+            self.sender.submit(to, self._flush, to, batch)
+
+    def _flush(self, to, batch):
+        """送出一批推播 (每 5 則一個請求)"""
+        with self.lock:
+            if self.outbox.get(to) is batch: del self.outbox[to]
+            messages = list(batch)
+            batch.clear()
+        self._push_now(to, messages)
+
+    def _push_now(self, to, messages):
+        for i in range(0, len(messages), MAX_MESSAGES):
+            self.post('/v2/bot/message/push', {'to': to, 'messages': messages[i:i + MAX_MESSAGES]}, retry_key=str(uuid.uuid4()))
+
+    def join(self):
+        """等待推播佇列送完 (測試與關機用)"""
+        self.sender.join()
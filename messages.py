@@ -0,0 +1,77 @@
+from game import HAND_LIMIT, GEM_LIMIT, CARD_NAMES
+
+# 事件 -> 聊天室文字。每個事件一段，以換行串接；GEM 接在上一段後面
+
+
+def _name(room, pid):
+    return room.players[pid].name
+
+
+def render_started(room, e):
+    txt = "🎮 遊戲開始！\n"
+    for pid in e['order']:
+        p = room.players[pid]
+        txt += f"{p.name}: {p.team}\n"
+    return txt + f"\n👉 輪到 {_name(room, e['order'][0])}"
+
+
+def render_card_drawn(room, e):
+    if e['remaining'] > 0: return f"🎴 {_name(room, e['player'])} 摸牌 (剩 {e['remaining']} 張)"
+    return f"✅ {_name(room, e['player'])} 摸牌結束。"
+
+
+def render_card_discarded(room, e):
+    if e['remaining'] > 0: return f"🗑️ {_name(room, e['player'])} 棄掉1張，剩 {e['remaining']} 張。"
+    return f"🗑️ {_name(room, e['player'])} 棄牌完畢。"
+
+
+def render_rejected(room, e):
+    reason = e['reason']
+    if reason == 'HAND_FULL': return f"❌ 手牌將爆 ({e['hand_size']}+3>{HAND_LIMIT})"
+    if reason == 'GEMS_FULL': return f"❌ 能量將滿 ({e['gems']}+2>{GEM_LIMIT})"
+    if reason == 'GEMS_LOW': return "❌ 能量不足3"
+    if reason == 'NO_GEMS': return "❌ 無能量"
+    return "❌ 無法執行"
+
+
+RENDERERS = {
+    'GAME_STARTED': render_started,
+    'DRAW_REQUIRED': lambda room, e: f"🎴 請 {_name(room, e['player'])} 摸牌 (需摸 {e['count']} 張)",
+    'DISCARD_REQUIRED': lambda room, e: f"⚠️ 手牌過多 ({e['hand_size']}/{HAND_LIMIT})！請棄 {e['count']} 張。",
+    'ACTION_RESUMED': lambda room, e: f"👉 輪到 {_name(room, e['player'])} 主動行動！",
+    'DAMAGE': lambda room, e: f"🛡️ 結算：傷{e['damage']} (癒{e['healed']}) = {e['final']}。",
+    'GEM': lambda room, e: f"({e['team']}獲得{'紅' if e['color']=='red' else '藍'}石)",
+    'WEAK_TURN': lambda room, e: f"\n👉 輪到 {_name(room, e['player'])} (虛弱狀態)\n請選擇 @摸牌 或 @跳過",
+    'POISONED': lambda room, e: f"☠️ {_name(room, e['player'])} 中毒發作！",
+    'TURN_START': lambda room, e: f"👉 輪到 [{room.players[e['player']].team}] {_name(room, e['player'])} 的回合！",
+    'WEAK_DRAW': lambda room, e: f"💫 {_name(room, e['player'])} 解除虛弱。\n👉 回合開始！",
+    'WEAK_SKIP': lambda room, e: f"💫 {_name(room, e['player'])} 跳過回合。",
+    'CARD_DRAWN': render_card_drawn,
+    'CARD_DISCARDED': render_card_discarded,
+    'BOUGHT': lambda room, e: f"💰 {_name(room, e['player'])} 購買：摸3張，產紅藍能量。",
+    'SYNTHESIZED': lambda room, e: f"⚗️ {_name(room, e['player'])} 合成：摸3張，產星杯，敵士氣-1。",
+    'GAME_WON': lambda room, e: f"🏆 {_name(room, e['player'])} 合成！\n🎉 [{e['team']}] 獲勝！",
+    'EXTRACTED': lambda room, e: f"⚡ {_name(room, e['player'])} 提煉了 {e['count']} 顆能量。",
+    'MISSILE_FIRED': lambda room, e: f"🔮 魔彈發射！鎖定 {_name(room, e['target'])} (傷{e['damage']})",
+    'MISSILE_BOUNCED': lambda room, e: f"🔮 {_name(room, e['player'])} 再度彈射魔彈！目標 {_name(room, e['target'])} (傷{e['damage']})",
+    'MISSILE_BLOCKED': lambda room, e: f"✨ {_name(room, e['player'])} 用 [{CARD_NAMES[e['card']]}] 抵銷魔彈！",
+    'BUFF_APPLIED': lambda room, e: f"✨ {_name(room, e['player'])} 對 {_name(room, e['target'])} 使用 [{CARD_NAMES[e['card']]}]",
+    'ATTACKED': lambda room, e: f"⚡ {_name(room, e['player'])} 攻擊 {_name(room, e['target'])}！請應戰/承受",
+    'SHIELD_BLOCKED': lambda room, e: f"🛡️ {_name(room, e['player'])} 消耗聖盾，抵銷了攻擊！",
+    'LIGHT_BLOCKED': lambda room, e: f"✨ {_name(room, e['player'])} 用聖光抵銷了攻擊！",
+    'ATTACK_REDIRECTED': lambda room, e: f"🔁 攻擊轉移給 {_name(room, e['target'])} ({e['element']})！",
+    'BOT_SEAT': lambda room, e: f"🤖 {_name(room, e['player'])} 改由電腦操作" if e['on'] else f"🙋 {_name(room, e['player'])} 改回玩家操作",
+    'REJECTED': render_rejected,
+}
+
+
+def render_events(room, events):
+    """把 apply_command 的事件清單轉成一則回覆文字 (沒有可顯示的事件時回傳 None)"""
+    parts = []
+    for e in events:
+        render = RENDERERS.get(e['type'])
+        if render is None: continue  # DECK_INIT / RESHUFFLE 等內部事件
+        text = render(room, e)
+        if e['type'] == 'GEM' and parts: parts[-1] += " " + text
+        else: parts.append(text)
+    return "\n".join(parts) if parts else None
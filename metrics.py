@@ -0,0 +1,151 @@
+import bisect
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import traceback
+
+# 手寫的 Prometheus 指標 (文字格式 0.0.4)。每個 worker 行程各自計數，由 Prometheus 分別抓取
+
+# 預設延遲分桶 (秒)：規則引擎在數十微秒，送 LINE 在數百毫秒
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value):
+    if value == float('inf'): return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock: self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock: items = sorted(self.values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [各分桶次數 (非累計)..., +Inf 次數, 總和]
+        self.values = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            row = self.values.get(labels)
+            if row is None: row = self.values[labels] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock: items = sorted((k, list(v)) for k, v in self.values.items())
+        for labels, row in items:
+            total = 0
+            for bound, n in zip(self.buckets + (float('inf'),), row):
+                total += n
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(row[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+class Gauge:
+    """抓取時才呼叫 fn() 取值 (回傳數字，或 {標籤值 tuple: 數字})；fn 回傳 None 時不輸出"""
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.name, self.help, self.fn, self.labelnames = name, help, fn, tuple(labelnames)
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.fn()
+        if value is None: return lines
+        if not isinstance(value, dict): value = {(): value}
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in sorted(value.items())]
+        return lines
+
+
+def render():
+    """所有指標的 Prometheus 文字格式"""
+    lines = []
+    for m in _metrics: lines += m.render()
+    return '\n'.join(lines) + '\n'
+
+
+class SlowCommandProfiler:
+    """取樣式分析：背景執行緒每隔 interval 秒抓一次「正在處理指令」的執行緒堆疊，保留最慢的 keep 筆"""
+
+    def __init__(self, interval, keep=20):
+        self.interval = interval
+        self.keep = keep
+        # 執行緒 ID -> [標籤, 開始時間, {堆疊: 取樣次數}]
+        self.active = {}
+        self.slowest = []
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def begin(self, label):
+        if self.pid != os.getpid(): self._start()
+        self.active[threading.get_ident()] = [label, time.perf_counter(), {}]
+
+    def _start(self):
+        # 與 Dispatcher 相同：fork 後在新行程重新啟動取樣執行緒
+        with self.lock:
+            if self.pid == os.getpid(): return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def end(self):
+        record = self.active.pop(threading.get_ident(), None)
+        if record is None: return
+        label, start, stacks = record
+        item = (time.perf_counter() - start, next(self.seq), label, stacks)
+        with self.lock:
+            if len(self.slowest) < self.keep: heapq.heappush(self.slowest, item)
+            elif item[0] > self.slowest[0][0]: heapq.heapreplace(self.slowest, item)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for tid, record in list(self.active.items()):
+                frame = frames.get(tid)
+                if frame is None: continue
+                stack = ''.join(traceback.format_stack(frame))
+                record[2][stack] = record[2].get(stack, 0) + 1
+
+    def dump(self):
+        """最慢的指令 (由慢到快)，附取樣到的堆疊與次數"""
+        with self.lock: items = sorted(self.slowest, reverse=True)
+        return [{'command': label, 'ms': round(dt * 1000, 3), 'samples': [{'count': n, 'stack': s} for s, n in sorted(stacks.items(), key=lambda x: -x[1])]}
+                for dt, _, label, stacks in items]
@@ -0,0 +1,43 @@
+import threading
+import time
+
+# 每個 worker 行程各自計數 (多 worker 時實際上限約為設定值 x worker 數)
+
+# 最多追蹤幾個鍵；超過時先清掉已經補滿 (閒置) 的桶
+MAX_KEYS = 100000
+
+
+class RateLimiter:
+    """權杖桶：每個鍵每秒補 rate 個權杖、最多存 burst 個；rate 為 0 時不限制"""
+
+    def __init__(self, rate, burst, max_keys=MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # 鍵 -> [剩餘權杖, 上次補充時間]
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, cost=1):
+        """扣權杖；成功回傳 0，不足時回傳還要等幾秒"""
+        if not self.rate: return 0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys: self._prune(now)
+                bucket = self.buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0
+            return (cost - bucket[0]) / self.rate
+
+    def _prune(self, now):
+        full = [k for k, (tokens, at) in self.buckets.items() if tokens + (now - at) * self.rate >= self.burst]
+        for k in full: del self.buckets[k]
+        # 都還在用：丟掉最早加入的一半
+        if len(self.buckets) >= self.max_keys:
+            for k in list(self.buckets)[:len(self.buckets) // 2]: del self.buckets[k]
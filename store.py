@@ -0,0 +1,541 @@
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import zlib
+from contextlib import contextmanager
+from urllib.parse import urlparse, quote, unquote
+
+from game import GameRoom
+from journal import Journal
+
+# 樂觀鎖衝突時重試的次數上限
+MAX_RETRIES = 20
+# 跨行程的儲存沒有通知機制：等待版本變化時的輪詢間隔 (秒)
+POLL_INTERVAL = 0.25
+# 記憶體儲存的常駐上限 (牌局數、序列化後的總位元組數)，超過就把最久沒用的牌局休眠到磁碟
+MAX_RESIDENT_GAMES = int(os.environ.get('MAX_RESIDENT_GAMES', 1000))
+MAX_RESIDENT_BYTES = int(os.environ.get('MAX_RESIDENT_BYTES', 64 * 1024 * 1024))
+# 閒置多久 (秒) 就休眠；已結束或尚未開局的牌局較快休眠
+IDLE_TTL = float(os.environ.get('GAME_IDLE_TTL', 1800))
+FINISHED_TTL = float(os.environ.get('GAME_FINISHED_TTL', 120))
+SWEEP_INTERVAL = float(os.environ.get('HIBERNATE_SWEEP_SECONDS', 5))
+# 已結束牌局的休眠檔保留多久 (秒) 後刪除
+FINISHED_KEEP = float(os.environ.get('GAME_FINISHED_KEEP', 86400))
+
+
+class StoreError(Exception):
+    pass
+
+
+def dump_room(room):
+    return json.dumps(room.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+
+def load_room(data):
+    return GameRoom.from_dict(json.loads(data))
+
+
+def backoff(attempt):
+    """衝突後隨機退避，避免多個 worker 同步重撞"""
+    time.sleep(random.uniform(0, 0.002 * (attempt + 1)))
+
+
+def poll_version(store, room_id, since, timeout):
+    """輪詢直到版本不同於 since 或逾時，回傳目前版本"""
+    deadline = time.monotonic() + timeout
+    while True:
+        version = store.version(room_id)
+        if version != since or time.monotonic() >= deadline: return version
+        time.sleep(min(POLL_INTERVAL, max(0, deadline - time.monotonic())))
+
+
+class KeyedLocks:
+    """每桌一把鎖 (同一行程內的執行緒依序處理同一桌)"""
+
+    def __init__(self):
+        self.locks = {}
+        self.guard = threading.Lock()
+
+    def __call__(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            with self.guard:
+                lock = self.locks.setdefault(key, threading.Lock())
+        return lock
+
+    def acquire(self, key, blocking=True):
+        """鎖住該 key 目前的鎖並回傳；等待期間鎖被 discard 換掉就改等新的 (blocking=False 且被佔住時回傳 None)"""
+        while True:
+            lock = self(key)
+            if not lock.acquire(blocking): return None
+            if self.locks.get(key) is lock: return lock
+            lock.release()
+
+    @contextmanager
+    def locked(self, key):
+        lock = self.acquire(key)
+        try: yield lock
+        finally: lock.release()
+
+    def discard(self, key, lock):
+        """移除該 key 的鎖 (呼叫端持有 lock)；不再使用的桌不必一直佔著記憶體"""
+        with self.guard:
+            if self.locks.get(key) is lock: del self.locks[key]
+
+
+class Hibernation:
+    """閒置牌局的磁碟存放區：每桌一個 zlib 壓縮的 JSON 檔，檔名帶版本號 (不必開檔就知道版本)；
+    已結束的牌局檔名多一個 .end，保留 FINISHED_KEEP 秒後刪除"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # room_id -> (版本, 檔名)；有日誌時牌局載回記憶體後檔案仍保留，作為日誌重播的基準
+        self.files = {}
+        # 已結束的牌局 room_id -> 寫入時間 (time.time())
+        self.finished = {}
+
+    def scan(self):
+        """依目錄內容重建索引 (同一桌有多個版本時只留最新的)"""
+        path = self.path
+        self.files, self.finished = {}, {}
+        for name in os.listdir(path):
+            if not name.endswith('.json.z'): continue
+            base = name[:-len('.json.z')]
+            finished = base.endswith('.end')
+            if finished: base = base[:-len('.end')]
+            key, version = base.rsplit('.', 1)
+            room_id, version = unquote(key), int(version)
+            old = self.files.get(room_id)
+            if old and old[0] >= version:
+                os.remove(os.path.join(path, name))
+                continue
+            if old: os.remove(os.path.join(path, old[1]))
+            self.files[room_id] = (version, name)
+            if finished: self.finished[room_id] = os.path.getmtime(os.path.join(path, name))
+            else: self.finished.pop(room_id, None)
+
+    def version(self, room_id):
+        entry = self.files.get(room_id)
+        return entry[0] if entry else None
+
+    def save(self, room):
+        """寫入 (先寫暫存檔再改名)，回傳壓縮後的位元組數"""
+        data = zlib.compress(dump_room(room).encode('utf-8'))
+        finished = room.state['phase'] == 'FINISHED'
+        name = f"{quote(room.room_id, safe='')}.{room.version}{'.end' if finished else ''}.json.z"
+        tmp = os.path.join(self.path, name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, name))
+        old = self.files.get(room.room_id)
+        self.files[room.room_id] = (room.version, name)
+        if old and old[1] != name: os.remove(os.path.join(self.path, old[1]))
+        if finished: self.finished[room.room_id] = time.time()
+        else: self.finished.pop(room.room_id, None)
+        return len(data)
+
+    def load(self, room_id):
+        with open(os.path.join(self.path, self.files[room_id][1]), 'rb') as f:
+            return load_room(zlib.decompress(f.read()))
+
+    def remove(self, room_id):
+        entry = self.files.pop(room_id, None)
+        self.finished.pop(room_id, None)
+        if entry is None: return
+        try: os.remove(os.path.join(self.path, entry[1]))
+        except FileNotFoundError: pass
+
+    def expired(self, now=None):
+        """已結束且超過保留時間的牌局"""
+        now = time.time() if now is None else now
+        return [room_id for room_id, at in list(self.finished.items()) if now - at >= FINISHED_KEEP]
+
+
+class MemoryStore:
+    """行程內字典 (只適用單一 worker)；有 journal 時每筆指令寫入日誌，重啟時由快照 + 日誌還原；
+    有 hibernation 時閒置/已結束或超出上限的牌局存到磁碟，下次存取時自動載回。
+    狀態在每個行程第一次使用時才從磁碟載入：preload 時 master 不載入，當掉重生的 worker 讀到的是磁碟上最新的狀態而不是開機時的副本"""
+
+    def __init__(self, journal=None, hibernation=None):
+        self.journal = journal
+        self.hibernation = hibernation
+        self.lock_for = KeyedLocks()
+        self.conds = {}
+        # 各桌正在 wait 的執行緒數 (有人在等就不移除該桌的鎖與 Condition)
+        self.waiters = {}
+        # 常駐牌局的最後存取時間 (LRU) 與 (版本, 序列化大小) 快取
+        self.last_used = {}
+        self.sizes = {}
+        self.rooms = {}
+        # 已載入狀態的行程
+        self.pid = None
+        self.guard = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self.pid == os.getpid(): return
+        with self.guard:
+            if self.pid == os.getpid(): return
+            self.lock_for = KeyedLocks()
+            self.conds, self.waiters, self.last_used, self.sizes = {}, {}, {}, {}
+            if self.hibernation: self.hibernation.scan()
+            rooms = self.journal.recover(self._load_hibernated) if self.journal else {}
+            if self.journal: self.journal.attach(self.dump_rooms)
+            if self.hibernation:
+                # 休眠檔比日誌還原的結果新 (日誌尾端未 fsync 就當機)：以休眠檔為準
+                for room_id, room in list(rooms.items()):
+                    version = self.hibernation.version(room_id)
+                    if version is not None and version > room.version: del rooms[room_id]
+            self.rooms = rooms
+            self.pid = os.getpid()
+            # 與 Dispatcher 相同：休眠的背景執行緒每個行程各自啟動
+            if self.hibernation: threading.Thread(target=self._sweep_loop, daemon=True).start()
+
+    def _load_hibernated(self, room_id):
+        if self.hibernation and room_id in self.hibernation.files: return self.hibernation.load(room_id)
+        return None
+
+    def _resident(self, room_id):
+        """取得常駐的牌局，已休眠的從磁碟載回 (須持有該桌的鎖)"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self._load_hibernated(room_id)
+            if room is not None:
+                self.rooms[room_id] = room
+                # 沒有日誌時檔案只會越來越舊 (重啟後會載回舊版本)：載回記憶體就刪掉
+                if not self.journal: self.hibernation.remove(room_id)
+        if room is not None: self.last_used[room_id] = time.monotonic()
+        return room
+
+    def _cond(self, room_id):
+        cond = self.conds.get(room_id)
+        if cond is None:
+            cond = self.conds.setdefault(room_id, threading.Condition(self.lock_for(room_id)))
+        return cond
+
+    def _exists(self, room_id):
+        return room_id in self.rooms or bool(self.hibernation and room_id in self.hibernation.files)
+
+    def _forget(self, room_id, lock):
+        """牌局已不在記憶體：移除該桌的鎖與 Condition (呼叫端持有 lock；有人在 wait 時保留)"""
+        with self.guard:
+            if self.waiters.get(room_id): return
+            self.conds.pop(room_id, None)
+            self.lock_for.discard(room_id, lock)
+
+    def get(self, room_id):
+        self._ensure_loaded()
+        room = self.rooms.get(room_id)
+        if room is not None:
+            self.last_used[room_id] = time.monotonic()
+            return room
+        if not self.hibernation or room_id not in self.hibernation.files: return None
+        with self.lock_for.locked(room_id): return self._resident(room_id)
+
+    def version(self, room_id):
+        self._ensure_loaded()
+        room = self.rooms.get(room_id)
+        if room: return room.version
+        return (self.hibernation and self.hibernation.version(room_id)) or 0
+
+    def update(self, room_id, fn):
+        """在該桌的鎖內執行 fn(room)；fn 回傳 None 代表狀態未變"""
+        self._ensure_loaded()
+        with self.lock_for.locked(room_id) as lock:
+            room = self._resident(room_id) or GameRoom(room_id)
+            result = fn(room)
+            if result is not None:
+                room.version += 1
+                self.rooms[room_id] = room
+                self.last_used[room_id] = time.monotonic()
+                if self.journal and room.command: self.journal.append(room, room.command)
+                self._cond(room_id).notify_all()
+            # 對不存在的桌操作 (沒有寫入)：不留下鎖
+            if room_id not in self.rooms: self._forget(room_id, lock)
+            return result
+
+    def read(self, room_id, fn):
+        """在該桌的鎖內對目前狀態執行 fn(room) (桌不存在時回傳 None)"""
+        self._ensure_loaded()
+        # 不存在的桌不建立鎖 (任何人都能送任意的 room=)
+        if not self._exists(room_id): return None
+        with self.lock_for.locked(room_id):
+            room = self._resident(room_id)
+            return fn(room) if room else None
+
+    def stats(self):
+        """(進行中的牌局數, 其中的玩家數)"""
+        self._ensure_loaded()
+        games = players = 0
+        for room in list(self.rooms.values()):
+            if room.state['phase'] in ('WAITING', 'FINISHED'): continue
+            games += 1
+            players += len(room.players)
+        return games, players
+
+    def dump_rooms(self):
+        """逐桌序列化 (快照用，每桌在自己的鎖內讀取；休眠中的牌局已在磁碟上)"""
+        for room_id in list(self.rooms):
+            with self.lock_for.locked(room_id):
+                room = self.rooms.get(room_id)
+                data = dump_room(room) if room else None
+            if data: yield data
+
+    def wait(self, room_id, since, timeout):
+        """阻塞直到該桌版本不同於 since 或逾時"""
+        self._ensure_loaded()
+        # 還不存在的桌不建立 Condition，以輪詢等它出現
+        if not self._exists(room_id): return poll_version(self, room_id, since, timeout)
+        with self.guard: self.waiters[room_id] = self.waiters.get(room_id, 0) + 1
+        try:
+            cond = self._cond(room_id)
+            with cond:
+                cond.wait_for(lambda: self.version(room_id) != since, timeout)
+                return self.version(room_id)
+        finally:
+            with self.guard:
+                self.waiters[room_id] -= 1
+                if not self.waiters[room_id]: del self.waiters[room_id]
+            # 等的是休眠中的桌 (沒被載回)：最後一個離開的人順便移除鎖
+            if room_id not in self.rooms:
+                lock = self.lock_for.acquire(room_id, blocking=False)
+                if lock:
+                    try:
+                        if room_id not in self.rooms: self._forget(room_id, lock)
+                    finally:
+                        lock.release()
+
+    # --- 休眠 ---
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try: self.hibernate_idle()
+            except Exception: traceback.print_exc()
+
+    def _size(self, room_id):
+        """序列化後的大小 (估計記憶體用量)；版本沒變就用上次的結果"""
+        room = self.rooms.get(room_id)
+        if room is None: return 0
+        cached = self.sizes.get(room_id)
+        if cached and cached[0] == room.version: return cached[1]
+        # 該桌正在處理指令就先用舊值，不等鎖
+        lock = self.lock_for.acquire(room_id, blocking=False)
+        if lock is None: return cached[1] if cached else 0
+        try:
+            size = len(dump_room(room))
+            self.sizes[room_id] = (room.version, size)
+            return size
+        finally:
+            lock.release()
+
+    def _hibernate(self, room_id):
+        self._ensure_loaded()
+        lock = self.lock_for.acquire(room_id, blocking=False)
+        if lock is None: return False
+        try:
+            room = self.rooms.get(room_id)
+            if room is None: return False
+            self.hibernation.save(room)
+            del self.rooms[room_id]
+            self.last_used.pop(room_id, None)
+            self.sizes.pop(room_id, None)
+            self._forget(room_id, lock)
+            return True
+        finally:
+            lock.release()
+
+    def hibernate_idle(self, now=None):
+        """閒置超過 TTL (已結束的牌局用較短的 TTL) 就休眠；常駐數或位元組數超過上限時從最久沒用的開始休眠；
+        並刪除過期的已結束牌局檔"""
+        now = time.monotonic() if now is None else now
+        oldest_first = sorted(self.rooms, key=lambda r: self.last_used.get(r, 0))
+        count = len(oldest_first)
+        sizes = {room_id: self._size(room_id) for room_id in oldest_first}
+        total = sum(sizes.values())
+        hibernated = 0
+        for room_id in oldest_first:
+            room = self.rooms.get(room_id)
+            if room is None: continue
+            ttl = FINISHED_TTL if room.state['phase'] in ('WAITING', 'FINISHED') else IDLE_TTL
+            idle = now - self.last_used.get(room_id, 0)
+            if idle < ttl and count <= MAX_RESIDENT_GAMES and total <= MAX_RESIDENT_BYTES: continue
+            if self._hibernate(room_id):
+                count -= 1
+                total -= sizes[room_id]
+                hibernated += 1
+        for room_id in self.hibernation.expired():
+            with self.lock_for.locked(room_id) as lock:
+                # 已被載回 (且有日誌) 的檔案仍是重播基準，等下次休眠再換掉
+                if room_id in self.rooms: continue
+                self.hibernation.remove(room_id)
+                self._forget(room_id, lock)
+        return hibernated
+
+
+class SQLiteStore:
+    """SQLite (WAL 模式)：多個 worker 共用同一個檔案，以版本號做樂觀鎖"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.lock_for = KeyedLocks()
+        self._conn().execute('CREATE TABLE IF NOT EXISTS games (room_id TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL)')
+
+    def _conn(self):
+        # 連線不可跨 fork 使用 (preload 時 master 建立的連線不能給 worker)
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, room_id):
+        row = self._conn().execute('SELECT data FROM games WHERE room_id=?', (room_id,)).fetchone()
+        return load_room(row[0]) if row else None
+
+    def version(self, room_id):
+        row = self._conn().execute('SELECT version FROM games WHERE room_id=?', (room_id,)).fetchone()
+        return row[0] if row else 0
+
+    def read(self, room_id, fn):
+        room = self.get(room_id)
+        return fn(room) if room else None
+
+    def stats(self):
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(json_array_length(data, '$.state.turn_order')), 0) FROM games WHERE json_extract(data, '$.state.phase') NOT IN ('WAITING', 'FINISHED')").fetchone()
+        return row[0], row[1]
+
+    def wait(self, room_id, since, timeout):
+        return poll_version(self, room_id, since, timeout)
+
+    def update(self, room_id, fn):
+        conn = self._conn()
+        with self.lock_for(room_id):
+            for attempt in range(MAX_RETRIES):
+                row = conn.execute('SELECT version, data FROM games WHERE room_id=?', (room_id,)).fetchone()
+                room = load_room(row[1]) if row else GameRoom(room_id)
+                result = fn(room)
+                if result is None: return None
+
+                room.version = (row[0] if row else 0) + 1
+                if row:
+                    cur = conn.execute('UPDATE games SET version=?, data=? WHERE room_id=? AND version=?', (room.version, dump_room(room), room_id, row[0]))
+                else:
+                    cur = conn.execute('INSERT OR IGNORE INTO games (room_id, version, data) VALUES (?, 1, ?)', (room_id, dump_room(room)))
+                if cur.rowcount == 1: return result
+                # 其他 worker 先寫入了：重新讀取再套用一次
+                backoff(attempt)
+        raise StoreError(f"版本衝突重試過多: {room_id}")
+
+
+class RespConnection:
+    """最小的 Redis 協定 (RESP) 用戶端，可連 Redis 或任何相容的本地替身"""
+
+    def __init__(self, url):
+        u = urlparse(url)
+        self.sock = socket.create_connection((u.hostname or 'localhost', u.port or 6379), timeout=10)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        if u.password: self.command('AUTH', u.password)
+        db = (u.path or '/0').lstrip('/') or '0'
+        if db != '0': self.command('SELECT', db)
+
+    def command(self, *args):
+        out = [b'*%d\r\n' % len(args)]
+        for a in args:
+            a = a if isinstance(a, bytes) else str(a).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(a), a))
+        self.sock.sendall(b''.join(out))
+        return self._read()
+
+    def _read(self):
+        line = self.rfile.readline()
+        if not line: raise StoreError("Redis 連線中斷")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+': return rest.decode()
+        if kind == b'-': raise StoreError(rest.decode())
+        if kind == b':': return int(rest)
+        if kind == b'$':
+            n = int(rest)
+            if n < 0: return None
+            data = self.rfile.read(n + 2)
+            return data[:-2]
+        if kind == b'*':
+            n = int(rest)
+            if n < 0: return None
+            return [self._read() for _ in range(n)]
+        raise StoreError(f"無法解析的回應: {line!r}")
+
+
+class RedisStore:
+    """Redis 協定儲存：以 WATCH/MULTI/EXEC 做樂觀鎖"""
+
+    def __init__(self, url):
+        self.url = url
+        self.local = threading.local()
+        self.lock_for = KeyedLocks()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.local.conn = RespConnection(self.url)
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, room_id):
+        data = self._conn().command('GET', f"game:{room_id}")
+        return load_room(data) if data else None
+
+    def version(self, room_id):
+        return int(self._conn().command('GET', f"game:{room_id}:v") or 0)
+
+    def read(self, room_id, fn):
+        room = self.get(room_id)
+        return fn(room) if room else None
+
+    def stats(self):
+        # 要掃描所有鍵才算得出來，不在抓取指標時做
+        return None
+
+    def wait(self, room_id, since, timeout):
+        return poll_version(self, room_id, since, timeout)
+
+    def update(self, room_id, fn):
+        conn = self._conn()
+        key = f"game:{room_id}"
+        with self.lock_for(room_id):
+            for attempt in range(MAX_RETRIES):
+                conn.command('WATCH', key)
+                data = conn.command('GET', key)
+                room = load_room(data) if data else GameRoom(room_id)
+                result = fn(room)
+                if result is None:
+                    conn.command('UNWATCH')
+                    return None
+
+                room.version += 1
+                conn.command('MULTI')
+                conn.command('SET', key, dump_room(room))
+                conn.command('SET', f"{key}:v", room.version)
+                if conn.command('EXEC') is not None: return result
+                backoff(attempt)
+        raise StoreError(f"版本衝突重試過多: {room_id}")
+
+
+def create_store(kind=None):
+    kind = kind or os.environ.get('GAME_STORE', 'memory')
+    if kind == 'sqlite': return SQLiteStore(os.environ.get('GAME_DB_PATH', 'game_state.db'))
+    if kind == 'redis': return RedisStore(os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+    journal_dir = os.environ.get('GAME_JOURNAL_DIR')
+    hibernate_dir = os.environ.get('GAME_HIBERNATE_DIR')
+    return MemoryStore(Journal(journal_dir) if journal_dir else None, Hibernation(hibernate_dir) if hibernate_dir else None)
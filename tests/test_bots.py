@@ -0,0 +1,50 @@
+import json
+import threading
+import time
+
+from game import GameRoom
+from commands import Command, apply_command, legal_commands
+from bots import PHASE_ACTOR, BotPool, search
+
+
+def request(seed=1):
+    """開局後輪到行動的玩家，回傳送進思考池的 (桌號, 版本, 玩家, 狀態 JSON)"""
+    room = GameRoom('T', seed)
+    apply_command(room, Command('START', None, None, None))
+    pid = PHASE_ACTOR[room.state['phase']](room)
+    return 'T', 1, pid, json.dumps(room.to_dict())
+
+
+def test_search_stops_at_deadline():
+    _, _, pid, state_json = request()
+    legal = legal_commands(GameRoom.from_dict(json.loads(state_json)))
+    assert len(legal) > 1
+    # 期限已過：不再逐一試每個指令，直接用快速走法
+    started = time.perf_counter()
+    cmd, n = search(state_json, pid, 0, 1)
+    assert n == 0 and cmd in legal
+    assert time.perf_counter() - started < 0.5
+    cmd, n = search(state_json, pid, 0.2, 1)
+    assert n > 0 and cmd in legal
+
+
+def test_pool_timeout_falls_back_to_quick_move():
+    # 思考時間遠大於逾時：逾時先到，之後想好的結果不會再出手一次
+    pool = BotPool(workers=1, move_ms=2000, timeout_ms=200)
+    moves, done = [], threading.Event()
+    def on_move(*args):
+        moves.append(args)
+        done.set()
+    pool.think(request(), on_move)
+    assert done.wait(5)
+    time.sleep(0.5)
+    assert [(m[0], m[1], m[3]) for m in moves] == [('T', 1, 'timeout')]
+    assert pool.pending == 0 and pool.pid is None
+    # 之後的思考使用新的行程池
+    moves.clear(); done.clear()
+    pool.timeout = 10
+    pool.budget = 0.05
+    pool.think(request(), on_move)
+    assert done.wait(10)
+    assert moves[0][3] == 'search'
+    pool.executor.shutdown()
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from game import GameRoom, CARD_INDEX
+from commands import Command, parse_command, format_command, apply_command, legal_commands
+
+
+def play(seed, steps):
+    """以固定種子隨機下 steps 步，依序產生每一步所有的合法指令"""
+    rng = random.Random(seed)
+    room = GameRoom('T', seed)
+    apply_command(room, Command('START', None, None, None))
+    for _ in range(steps):
+        options = legal_commands(room)
+        if not options: return
+        yield options
+        apply_command(room, rng.choice(options))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_legal_commands_round_trip(seed):
+    seen = set()
+    for options in play(seed, 300):
+        for cmd in options:
+            assert parse_command(format_command(cmd)) == cmd
+            seen.add(cmd.verb)
+    assert {'PLAY', 'DRAW', 'DISCARD'} <= seen
+
+
+@pytest.mark.parametrize('cmd', [
+    Command('START', None, None, None),
+    Command('BOT', None, None, '紅1'),
+    Command('BOT', '藍2', None, '紅 1'),
+    Command('SKIP', '紅2', None, None),
+    Command('PLAY', '紅1', CARD_INDEX['聖盾'], '紅1'),
+    Command('PLAY', '紅1', CARD_INDEX['魔彈'], None),
+    Command('COUNTER', '藍1', CARD_INDEX['聖光'], None),
+])
+def test_round_trip(cmd):
+    assert parse_command(format_command(cmd)) == cmd
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('  [紅1]   @摸牌  ', Command('DRAW', '紅1', None, None)),
+    ('@摸牌', Command('DRAW', None, None, None)),
+    ('[紅1]打出了[聖光]', Command('PLAY', '紅1', CARD_INDEX['聖光'], None)),
+    ('[藍1] 棄牌 [聖盾]', Command('DISCARD', '藍1', CARD_INDEX['聖盾'], None)),
+])
+def test_parse(text, expected):
+    assert parse_command(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', '大家好', '[紅1] 購買 謝謝', '[紅1] 棄牌 [不存在的牌]', '[紅1] 打出了 []', '@電腦'])
+def test_parse_rejects(text):
+    assert parse_command(text) is None
@@ -0,0 +1,121 @@
+import os
+import random
+
+from commands import Command, apply_command, legal_commands
+from journal import Journal, read_entries
+from store import MemoryStore, Hibernation
+
+START = Command('START', None, None, None)
+
+
+def play(store, room_id, rng, steps):
+    """開局後隨機下 steps 步 (每步經過 store.update，與線上相同地寫入日誌)"""
+    def step(room):
+        options = legal_commands(room)
+        return apply_command(room, rng.choice(options)) if options else None
+    if store.version(room_id) == 0: store.update(room_id, lambda room: apply_command(room, START))
+    for _ in range(steps): store.update(room_id, step)
+
+
+def state(store, room_id):
+    return store.get(room_id).to_dict()
+
+
+def reopen(path, hibernate_path=None):
+    """模擬重啟：以新的 Journal 從同一個目錄還原"""
+    return MemoryStore(Journal(path, snapshot_every=10 ** 9), Hibernation(hibernate_path) if hibernate_path else None)
+
+
+def test_recover_replays_log(tmp_path):
+    store = reopen(tmp_path)
+    play(store, 'G1', random.Random(1), 80)
+    play(store, 'G2', random.Random(2), 40)
+    store.journal.sync()
+    restored = reopen(tmp_path)
+    assert state(restored, 'G1') == state(store, 'G1')
+    assert state(restored, 'G2') == state(store, 'G2')
+
+
+def test_recover_after_compaction(tmp_path):
+    store = reopen(tmp_path)
+    rng = random.Random(3)
+    play(store, 'G1', rng, 60)
+    store.journal.compact()
+    play(store, 'G1', rng, 60)
+    play(store, 'G2', rng, 20)
+    store.journal.sync()
+    journal = store.journal
+    # 快照之前的日誌與舊快照都已刪除
+    assert len(journal._list('snapshot')) == 1
+    assert min(journal._list('log')) == journal._list('snapshot')[0]
+    restored = reopen(tmp_path)
+    assert state(restored, 'G1') == state(store, 'G1')
+    assert state(restored, 'G2') == state(store, 'G2')
+
+
+def test_torn_last_line(tmp_path):
+    store = reopen(tmp_path)
+    rng = random.Random(4)
+    play(store, 'G1', rng, 50)
+    store.journal.sync()
+    expected = state(store, 'G1')
+    # 當機時寫到一半的最後一行
+    last = store.journal._file('log', store.journal.seq)
+    with open(last, 'a', encoding='utf-8') as f: f.write('{"r":"G1","v":%d,"c":["DRA' % (expected['version'] + 1))
+    restored = reopen(tmp_path)
+    assert state(restored, 'G1') == expected
+    # 還原後接著寫到新的檔案，再次還原仍然正確
+    play(restored, 'G1', rng, 20)
+    restored.journal.sync()
+    assert state(reopen(tmp_path), 'G1') == state(restored, 'G1')
+
+
+def test_hibernated_game_recovers_from_file_and_journal(tmp_path):
+    journal_dir, hibernate_dir = tmp_path / 'journal', tmp_path / 'hibernate'
+    store = reopen(journal_dir, hibernate_dir)
+    rng = random.Random(5)
+    play(store, 'G1', rng, 40)
+    play(store, 'G2', rng, 40)
+    assert store._hibernate('G1')
+    # 休眠中的牌局不在快照內，重啟時以休眠檔為基準重播之後的日誌
+    store.journal.compact()
+    play(store, 'G1', rng, 30)
+    play(store, 'G2', rng, 10)
+    store.journal.sync()
+    restored = reopen(journal_dir, hibernate_dir)
+    assert state(restored, 'G1') == state(store, 'G1')
+    assert state(restored, 'G2') == state(store, 'G2')
+
+
+def test_hibernation_without_journal_drops_rehydrated_file(tmp_path):
+    store = MemoryStore(None, Hibernation(tmp_path))
+    play(store, 'G1', random.Random(6), 20)
+    assert store._hibernate('G1')
+    assert len(os.listdir(tmp_path)) == 1
+    play(store, 'G1', random.Random(7), 5)
+    # 載回後檔案已刪除：重啟不會拿回舊版本
+    assert os.listdir(tmp_path) == []
+    assert MemoryStore(None, Hibernation(tmp_path)).get('G1') is None
+
+
+def test_store_loads_in_each_process(tmp_path):
+    """preload 時 store 在 master 建立但不載入；worker 重生後從磁碟還原，接著前一個 worker 的進度"""
+    import multiprocessing
+    store = reopen(tmp_path)
+    context = multiprocessing.get_context('fork')
+
+    def worker(steps, seed):
+        play(store, 'G1', random.Random(seed), steps)
+        store.journal.sync()
+
+    for seed in (1, 2):
+        p = context.Process(target=worker, args=(30, seed))
+        p.start()
+        p.join()
+        assert p.exitcode == 0
+    assert store.pid is None
+    # 兩個 worker 的指令接續在同一局 (第二個沒有從 v1 重來)：日誌裡每個版本只出現一次
+    journal = Journal(tmp_path)
+    versions = [e['v'] for seq in journal._list('log') for e in read_entries(journal._file('log', seq)) if e['r'] == 'G1']
+    assert versions == list(range(1, len(versions) + 1))
+    assert state(reopen(tmp_path), 'G1')['version'] == len(versions) > 31
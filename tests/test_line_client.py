@@ -0,0 +1,47 @@
+import threading
+
+from line_client import LineClient, LineApiError
+
+
+def client(fail_reply=False):
+    """post 改為記錄 (端點, 文字)；fail_reply 時回覆失敗 (例如 token 已失效)"""
+    line = LineClient('token', base_url='http://127.0.0.1:9')
+    line.sent = []
+    def post(path, body, retry_key=None):
+        endpoint = path.rsplit('/', 1)[-1]
+        if fail_reply and endpoint == 'reply': raise LineApiError(400, 'Invalid reply token')
+        line.sent.append((endpoint, [m['text'] for m in body['messages']]))
+    line.post = post
+    return line
+
+
+def blocked(line, to):
+    """佔住該對象的送出執行緒，讓之後的回覆/推播都在排隊中"""
+    gate = threading.Event()
+    line.sender.submit(to, gate.wait)
+    return gate
+
+
+def test_reply_keeps_issue_order_with_queued_pushes():
+    line = client()
+    gate = blocked(line, 'G1')
+    line.push('G1', ['P1'])
+    line.reply('token', 'G1', ['R2'])
+    line.push('G1', ['P3'])
+    line.push('G1', ['P4'])
+    gate.set()
+    line.join()
+    # 回覆之前的推播先送；之後的推播跟在回覆後面 (併入同一次回覆)
+    assert line.sent == [('push', ['P1']), ('reply', ['R2', 'P3', 'P4'])]
+
+
+def test_failed_reply_falls_back_to_push_in_order():
+    line = client(fail_reply=True)
+    gate = blocked(line, 'G1')
+    line.reply('token', 'G1', ['R1'])
+    line.push('G1', ['P2'])
+    gate.set()
+    line.join()
+    line.push('G1', ['P3'])
+    line.join()
+    assert line.sent == [('push', ['R1', 'P2']), ('push', ['P3'])]
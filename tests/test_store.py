@@ -0,0 +1,49 @@
+import threading
+import time
+
+from commands import Command, apply_command
+from store import MemoryStore, Hibernation
+
+START = Command('START', None, None, None)
+
+
+def start(store, room_id):
+    store.update(room_id, lambda room: apply_command(room, START))
+
+
+def test_unknown_rooms_leave_no_locks():
+    store = MemoryStore()
+    assert store.read('nope', lambda room: room) is None
+    assert store.get('nope') is None
+    assert store.wait('nope', 0, 0.01) == 0
+    # 對不存在的桌操作但沒有寫入
+    assert store.update('nope', lambda room: None) is None
+    assert store.lock_for.locks == {} and store.conds == {}
+
+
+def test_hibernate_drops_lock_and_condition(tmp_path):
+    store = MemoryStore(None, Hibernation(tmp_path))
+    start(store, 'G1')
+    store.wait('G1', 0, 0.01)
+    assert 'G1' in store.lock_for.locks and 'G1' in store.conds
+    assert store._hibernate('G1')
+    assert store.lock_for.locks == {} and store.conds == {}
+    # 載回後照常運作
+    start(store, 'G1')
+    assert store.version('G1') == 2
+
+
+def test_hibernate_keeps_lock_while_someone_waits(tmp_path):
+    store = MemoryStore(None, Hibernation(tmp_path))
+    start(store, 'G1')
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(store.wait('G1', 1, 5)))
+    waiter.start()
+    while not store.waiters: time.sleep(0.001)
+    assert store._hibernate('G1')
+    assert 'G1' in store.conds
+    # 在休眠期間更新 (載回) 仍會喚醒等待中的人
+    start(store, 'G1')
+    waiter.join(1)
+    assert result == [2]
+    assert store.waiters == {}
@@ -0,0 +1,133 @@
+"""LINE Messaging API 的本地替身 (離線測試送訊息的吞吐量與失敗情境)。
+
+    python tools/line_stub.py --port 8081 --latency-ms 30 --fail-rate 0.05 --throttle-rate 0.02
+    LINE_API_URL=http://localhost:8081 python app.py
+
+支援 POST /v2/bot/message/reply 與 /v2/bot/message/push：檢查 Bearer token、每次最多 5 則、
+reply token 只能用一次 (重複使用回 400)、push 的 X-Line-Retry-Key 已受理時回 409。
+--fail-rate 回 500、--throttle-rate 回 429 (附 Retry-After)，--down 模擬整個服務無回應。
+GET /stats 回傳計數；POST /stats/reset 清除計數。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_MESSAGES = 5
+
+
+class Stub:
+    def __init__(self, opts):
+        self.opts = opts
+        self.lock = threading.Lock()
+        self.rng = random.Random(opts.seed)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'reply': 0, 'push': 0, 'messages': 0, 'errors_500': 0, 'errors_429': 0, 'bad_request': 0, 'duplicate_retry_key': 0}
+            self.used_tokens = set()
+            self.retry_keys = set()
+            self.sent = {}
+
+    def roll(self):
+        with self.lock: return self.rng.random()
+
+
+def make_handler(stub):
+    opts = stub.opts
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            if opts.verbose: super().log_message(*args)
+
+        def send_json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for k, v in (headers or {}).items(): self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != '/stats': return self.send_json(404, {'message': 'Not found'})
+            with stub.lock: body = dict(stub.stats, destinations=len(stub.sent))
+            self.send_json(200, body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.path == '/stats/reset':
+                stub.reset()
+                return self.send_json(200, {})
+            kind = {'/v2/bot/message/reply': 'reply', '/v2/bot/message/push': 'push'}.get(self.path)
+            if kind is None: return self.send_json(404, {'message': 'Not found'})
+
+            if opts.down: return time.sleep(opts.down)  # 不回應 (讓用戶端逾時)
+            if opts.latency_ms: time.sleep(opts.latency_ms / 1000 * stub.roll() * 2)
+
+            if not self.headers.get('Authorization', '').startswith('Bearer '):
+                return self.send_json(401, {'message': 'Authentication failed'})
+            r = stub.roll()
+            if r < opts.fail_rate:
+                with stub.lock: stub.stats['errors_500'] += 1
+                return self.send_json(500, {'message': 'Internal server error'})
+            if r < opts.fail_rate + opts.throttle_rate:
+                with stub.lock: stub.stats['errors_429'] += 1
+                return self.send_json(429, {'message': 'Too Many Requests'}, {'Retry-After': '1'})
+
+            try: data = json.loads(body)
+            except ValueError: data = None
+            messages = (data or {}).get('messages') or []
+            if not 1 <= len(messages) <= MAX_MESSAGES:
+                with stub.lock: stub.stats['bad_request'] += 1
+                return self.send_json(400, {'message': 'The request body has 1 error(s)'})
+
+            with stub.lock:
+                if kind == 'reply':
+                    token = data.get('replyToken')
+                    if not token or token in stub.used_tokens:
+                        stub.stats['bad_request'] += 1
+                        return self.send_json(400, {'message': 'Invalid reply token'})
+                    stub.used_tokens.add(token)
+                    to = token
+                else:
+                    key = self.headers.get('X-Line-Retry-Key')
+                    if key and key in stub.retry_keys:
+                        stub.stats['duplicate_retry_key'] += 1
+                        return self.send_json(409, {'message': 'The retry key is already accepted'})
+                    if key: stub.retry_keys.add(key)
+                    to = data.get('to')
+                stub.stats[kind] += 1
+                stub.stats['messages'] += len(messages)
+                stub.sent[to] = stub.sent.get(to, 0) + len(messages)
+            self.send_json(200, {})
+
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8081)
+    ap.add_argument('--latency-ms', type=float, default=0, help='平均回應延遲')
+    ap.add_argument('--fail-rate', type=float, default=0, help='回 500 的比例')
+    ap.add_argument('--throttle-rate', type=float, default=0, help='回 429 的比例')
+    ap.add_argument('--down', type=float, default=0, help='每個請求卡住幾秒不回應')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--verbose', action='store_true')
+    opts = ap.parse_args()
+
+    server = ThreadingHTTPServer((opts.host, opts.port), make_handler(Stub(opts)))
+    server.daemon_threads = True
+    print(f"LINE API stub on http://{opts.host}:{opts.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
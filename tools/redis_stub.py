@@ -0,0 +1,153 @@
+"""Redis 的本地替身 (沒有 Redis 伺服器時測試 GAME_STORE=redis 與多 worker 部署)。
+
+    python tools/redis_stub.py --port 6379
+    GAME_STORE=redis REDIS_URL=redis://127.0.0.1:6379/0 gunicorn -c gunicorn.conf.py app:app
+
+只實作 RedisStore 用到的 RESP 指令：PING、AUTH、SELECT、GET、SET、DEL、INCR、EXISTS、DBSIZE、FLUSHDB、FLUSHALL，
+以及樂觀鎖用的 WATCH/UNWATCH/MULTI/EXEC/DISCARD (EXEC 前被監看的鍵有任何寫入就回傳 nil)。
+資料只存在記憶體，結束即消失。
+"""
+import argparse
+import socketserver
+import threading
+
+
+class Stub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # db 編號 -> {鍵: 值}；每個鍵的寫入次數 (WATCH 用來判斷是否被改過)
+        self.dbs = {}
+        self.writes = {}
+
+    def db(self, n):
+        return self.dbs.setdefault(n, {})
+
+    def touch(self, n, key):
+        self.writes[(n, key)] = self.writes.get((n, key), 0) + 1
+
+
+class Error(Exception):
+    pass
+
+
+def encode(value):
+    """Python 值 -> RESP (str 為簡單字串、bytes 為 bulk、None 為 nil)"""
+    if isinstance(value, Error): return b'-%s\r\n' % str(value).encode('utf-8')
+    if value is None: return b'$-1\r\n'
+    if isinstance(value, bool) or isinstance(value, int): return b':%d\r\n' % value
+    if isinstance(value, str): return b'+%s\r\n' % value.encode('utf-8')
+    if isinstance(value, bytes): return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, list): return b'*%d\r\n' % len(value) + b''.join(encode(v) for v in value)
+    raise TypeError(value)
+
+
+def make_handler(stub):
+
+    class Handler(socketserver.StreamRequestHandler):
+        disable_nagle_algorithm = True
+
+        def read_command(self):
+            line = self.rfile.readline()
+            if not line: return None
+            if not line.startswith(b'*'): return line.split()  # inline 指令 (例如 telnet 測試)
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            return args
+
+        def handle(self):
+            self.dbn = 0
+            self.watched = {}
+            self.queued = None
+            while True:
+                args = self.read_command()
+                if args is None: return
+                if not args: continue
+                self.wfile.write(encode(self.execute(args[0].decode().upper(), args[1:])))
+
+        def execute(self, name, args):
+            if self.queued is not None and name not in ('EXEC', 'DISCARD', 'MULTI', 'WATCH'):
+                self.queued.append((name, args))
+                return 'QUEUED'
+            with stub.lock:
+                if name == 'MULTI':
+                    self.queued = []
+                    return 'OK'
+                if name == 'DISCARD':
+                    self.queued, self.watched = None, {}
+                    return 'OK'
+                if name == 'EXEC':
+                    if self.queued is None: return Error('ERR EXEC without MULTI')
+                    queued, self.queued = self.queued, None
+                    changed = any(stub.writes.get(k, 0) != n for k, n in self.watched.items())
+                    self.watched = {}
+                    if changed: return None
+                    return [self.run(n, a) for n, a in queued]
+                if name == 'WATCH':
+                    if self.queued is not None: return Error('ERR WATCH inside MULTI is not allowed')
+                    for key in args: self.watched[(self.dbn, key)] = stub.writes.get((self.dbn, key), 0)
+                    return 'OK'
+                if name == 'UNWATCH':
+                    self.watched = {}
+                    return 'OK'
+                return self.run(name, args)
+
+        def run(self, name, args):
+            """執行一個一般指令 (呼叫端持有 stub.lock)"""
+            data = stub.db(self.dbn)
+            try:
+                if name == 'PING': return args[0] if args else 'PONG'
+                if name == 'AUTH': return 'OK'
+                if name == 'SELECT':
+                    self.dbn = int(args[0])
+                    return 'OK'
+                if name == 'GET': return data.get(args[0])
+                if name == 'SET':
+                    data[args[0]] = args[1]
+                    stub.touch(self.dbn, args[0])
+                    return 'OK'
+                if name == 'DEL':
+                    found = [k for k in args if k in data]
+                    for k in found:
+                        del data[k]
+                        stub.touch(self.dbn, k)
+                    return len(found)
+                if name == 'INCR':
+                    value = int(data.get(args[0], b'0')) + 1
+                    data[args[0]] = str(value).encode()
+                    stub.touch(self.dbn, args[0])
+                    return value
+                if name == 'EXISTS': return sum(1 for k in args if k in data)
+                if name == 'DBSIZE': return len(data)
+                if name in ('FLUSHDB', 'FLUSHALL'):
+                    dbs = list(stub.dbs) if name == 'FLUSHALL' else [self.dbn]
+                    for n in dbs:
+                        for k in stub.dbs[n]: stub.touch(n, k)
+                        stub.dbs[n] = {}
+                    return 'OK'
+            except (IndexError, ValueError):
+                return Error(f"ERR wrong arguments for '{name.lower()}' command")
+            return Error(f"ERR unknown command '{name.lower()}'")
+
+    return Handler
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=6379)
+    opts = ap.parse_args()
+
+    server = Server((opts.host, opts.port), make_handler(Stub()))
+    print(f"Redis stub on redis://{opts.host}:{opts.port}/0", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
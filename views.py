@@ -0,0 +1,108 @@
+import json
+
+# /api/my_status 的視圖：公開部分每個版本只組一次、編碼一次，所有視角共用；
+# 私人部分 (手牌等) 也按版本預先編碼，回應時只做字串拼接
+
+# 每桌保留最近幾個版本 (差異模式需要舊版本來比對)
+VIEW_HISTORY = 8
+# 最多快取幾桌 (超過時丟掉最早加入的)
+VIEW_CACHE_ROOMS = 2048
+
+# room_id -> {version: entry}
+_cache = {}
+
+
+def encode(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def turn_owner_id(room):
+    """目前有操作權的玩家"""
+    game_state = room.state
+    phase = game_state['phase']
+    if phase == 'ACTION': return room.get_current_player_id()
+    if phase in ['DRAWING', 'DISCARDING', 'CHOOSING_WEAKNESS']: return game_state.get('active_player_id')
+    if phase == 'RESOLVING' and game_state['attack_chain']: return game_state['attack_chain']['target_id']
+    if phase == 'RESOLVING_MISSILE' and game_state['missile_chain']: return game_state['missile_chain']['target_id']
+    return None
+
+
+def incoming_attack(game_state):
+    chain = game_state['attack_chain']
+    if chain:
+        return {'type': 'normal', 'source_name': chain['source_name'], 'target_id': chain['target_id'], 'card_name': chain['card_name'], 'element': chain['element']}
+    chain = game_state['missile_chain']
+    if chain:
+        return {'type': 'missile', 'source_name': "魔彈連鎖", 'target_id': chain['target_id'], 'damage': chain['damage']}
+    return None
+
+
+def public_view(room):
+    """所有視角都相同的部分"""
+    game_state = room.state
+    return {
+        'room': room.room_id,
+        'version': room.version,
+        'game_phase': game_state['phase'],
+        'turn_owner_id': turn_owner_id(room),
+        'teams': game_state['teams'],
+        'pending_count': game_state.get('pending_draw_count', 0),
+        'incoming_attack': incoming_attack(game_state),
+        'bots': game_state.get('bots', []),
+        'all_players': [{'name': room.players[pid].name, 'team': room.players[pid].team, 'id': pid} for pid in game_state['turn_order']],
+    }
+
+
+def private_view(room, pid, owner):
+    """某位玩家自己的部分"""
+    view = room.players[pid].to_view()
+    view['my_id'] = pid
+    view['is_my_turn'] = (pid == owner)
+    return view
+
+
+def view_entry(room):
+    """取得 (必要時建立) 該桌目前版本的視圖；呼叫端須保證 room 在此期間不被修改"""
+    versions = _cache.get(room.room_id)
+    if versions is None:
+        if len(_cache) >= VIEW_CACHE_ROOMS: _cache.pop(next(iter(_cache)), None)
+        versions = _cache.setdefault(room.room_id, {})
+    entry = versions.get(room.version)
+    if entry is not None: return entry
+
+    # 編碼後再解回來當作保存的副本 (room 之後會被就地修改)
+    public_json = encode(public_view(room))
+    owner = turn_owner_id(room)
+    private_json = {pid: encode(private_view(room, pid, owner)) for pid in room.players}
+    entry = {
+        'version': room.version,
+        'public': json.loads(public_json), 'public_json': public_json[1:-1],
+        'private': {pid: json.loads(text) for pid, text in private_json.items()},
+        'private_json': {pid: text[1:-1] for pid, text in private_json.items()},
+    }
+    versions[room.version] = entry
+    while len(versions) > VIEW_HISTORY: versions.pop(min(versions), None)
+    return entry
+
+
+def cached(room_id, version):
+    return _cache.get(room_id, {}).get(version)
+
+
+def status(entry, pid):
+    """某位玩家視角的完整狀態 (dict)"""
+    return dict(entry['public'], **entry['private'][pid])
+
+
+def status_json(entry, pid):
+    """某位玩家視角的完整狀態 (已編碼，公開部分直接拼接)"""
+    return '{' + entry['private_json'][pid] + ',' + entry['public_json'] + '}'
+
+
+def delta_json(entry, pid, since):
+    """只含 since 版本之後有變動的欄位；舊版本已不在快取時回傳 None (改送完整狀態)"""
+    old = cached(entry['public']['room'], since)
+    if old is None or pid not in old['private']: return None
+    before = status(old, pid)
+    changed = {k: v for k, v in status(entry, pid).items() if before.get(k) != v}
+    return encode({'delta': True, 'since': since, 'version': entry['version'], 'changed': changed})